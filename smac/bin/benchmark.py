@@ -0,0 +1,159 @@
+"""Benchmark the Python overhead of StarCraft2Env without StarCraft II.
+
+The environment is run with a FakeRunConfig, so that the timings include
+the cost of the crude simulation of the fake controller but not that of
+the game. Example:
+
+    python -m smac.bin.benchmark --maps 3m,MMM2 --scales 1,4 --steps 500
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from smac.env.starcraft2.fake_sc2 import MAP_UNITS, FakeRunConfig
+from smac.env.starcraft2.maps import smac_maps
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+
+TIMED_CALLS = ("step", "get_obs", "get_state", "get_avail_actions")
+
+
+def register_scaled_map(map_name, scale):
+    """Register a synthetic copy of a SMAC map with scale times as many
+    agents and enemies, which can only be played with a FakeRunConfig.
+    Returns the name of the copy.
+    """
+    if scale == 1:
+        return map_name
+    scaled_name = "{}_x{}".format(map_name, scale)
+    registry = smac_maps.get_smac_map_registry()
+    if scaled_name not in registry:
+        map_params = dict(registry[map_name])
+        map_params["n_agents"] *= scale
+        map_params["n_enemies"] *= scale
+        registry[scaled_name] = map_params
+        MAP_UNITS[scaled_name] = tuple(
+            [(unit_type, n_units * scale) for unit_type, n_units in units]
+            for units in MAP_UNITS[map_name]
+        )
+        # Registers the map with pysc2, which only holds weak references
+        # to it, so it is kept in smac_maps like the SMAC maps
+        map_class = type(
+            scaled_name, (smac_maps.SMACMap,), dict(filename=scaled_name)
+        )
+        setattr(smac_maps, scaled_name, map_class)
+    return scaled_name
+
+
+def benchmark(map_name, n_steps, seed=0, **env_args):
+    """Run random agents for n_steps steps of map_name, returning the
+    number of agents and enemies, the steps per second and the mean time
+    of every timed call in microseconds.
+    """
+    env = StarCraft2Env(
+        map_name=map_name, run_config=FakeRunConfig(seed=seed), **env_args
+    )
+    rng = np.random.RandomState(seed)
+    totals = dict.fromkeys(TIMED_CALLS, 0.0)
+    perf_counter = time.perf_counter
+    try:
+        env.reset()
+        start = perf_counter()
+        for _ in range(n_steps):
+            t0 = perf_counter()
+            env.get_obs()
+            t1 = perf_counter()
+            env.get_state()
+            t2 = perf_counter()
+            avail_actions = env.get_avail_actions()
+            t3 = perf_counter()
+            actions = [
+                rng.choice(np.flatnonzero(avail)) for avail in avail_actions
+            ]
+            t4 = perf_counter()
+            _, terminated, _ = env.step(actions)
+            t5 = perf_counter()
+            totals["get_obs"] += t1 - t0
+            totals["get_state"] += t2 - t1
+            totals["get_avail_actions"] += t3 - t2
+            totals["step"] += t5 - t4
+            if terminated:
+                env.reset()
+        elapsed = perf_counter() - start
+    finally:
+        env.close()
+    result = {
+        "map": map_name,
+        "agents": env.n_agents,
+        "enemies": env.n_enemies,
+        "steps/s": n_steps / elapsed,
+    }
+    for name in TIMED_CALLS:
+        result[name + " us"] = totals[name] / n_steps * 1e6
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--maps",
+        default=None,
+        help="Comma separated maps to benchmark (default: all SMAC maps).",
+    )
+    parser.add_argument(
+        "--scales",
+        default="1",
+        help="Comma separated factors by which the units of every map are "
+        "multiplied (default: 1).",
+    )
+    parser.add_argument(
+        "--steps", type=int, default=1000, help="Steps per benchmark."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--reference",
+        action="store_true",
+        help="Use the reference, non-vectorised implementation.",
+    )
+    args = parser.parse_args()
+
+    if args.maps:
+        map_names = args.maps.split(",")
+    else:
+        map_names = list(smac_maps.get_smac_map_registry())
+    scales = [int(scale) for scale in args.scales.split(",")]
+
+    columns = ["map", "agents", "enemies", "steps/s"] + [
+        name + " us" for name in TIMED_CALLS
+    ]
+    row_format = "{:<20}" + "".join(
+        "{{:>{}}}".format(max(len(c) + 2, 10)) for c in columns[1:]
+    )
+    print(row_format.format(*columns))
+    for map_name in map_names:
+        for scale in scales:
+            result = benchmark(
+                register_scaled_map(map_name, scale),
+                args.steps,
+                seed=args.seed,
+                vectorized=not args.reference,
+            )
+            print(
+                row_format.format(
+                    *[
+                        "{:.1f}".format(result[c])
+                        if isinstance(result[c], float)
+                        else result[c]
+                        for c in columns
+                    ]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,17 @@ from __future__ import division
 from __future__ import print_function
 
 from smac.env.multiagentenv import MultiAgentEnv
+from smac.env.starcraft2.async_env import AsyncStarCraft2Env
+from smac.env.starcraft2.process_pool import StarCraft2ProcessPool
 from smac.env.starcraft2.starcraft2 import StarCraft2Env
+from smac.env.starcraft2.threaded_env import StarCraft2ThreadedEnv
+from smac.env.starcraft2.vec_env import StarCraft2VecEnv
 
-__all__ = ["MultiAgentEnv", "StarCraft2Env"]
+__all__ = [
+    "AsyncStarCraft2Env",
+    "MultiAgentEnv",
+    "StarCraft2Env",
+    "StarCraft2ProcessPool",
+    "StarCraft2ThreadedEnv",
+    "StarCraft2VecEnv",
+]
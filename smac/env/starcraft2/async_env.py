@@ -0,0 +1,503 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import asyncio
+import functools
+import itertools
+import os
+import struct
+import time
+
+import numpy as np
+
+from pysc2.lib import protocol
+
+from s2clientprotocol import sc2api_pb2 as sc_pb
+
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+
+# Websocket opcodes
+_BINARY = 0x2
+_CLOSE = 0x8
+_PING = 0x9
+_PONG = 0xA
+
+
+class AsyncStarcraftProtocol(object):
+    """Speaks the StarCraft II API over a websocket through the asyncio event
+    loop, as pysc2's StarcraftProtocol does with blocking sockets.
+
+    Only the framing needed to exchange binary messages with StarCraft II
+    is implemented. The websocket handshake is left to pysc2, and the
+    connection is taken over from a connected controller.
+    """
+
+    def __init__(self, reader, writer, timeout=None, recorder=None):
+        """Create a protocol given the streams of a connection to StarCraft
+        II, the timeout in seconds of requests (None to wait indefinitely)
+        and a StreamRecorder recording the action requests and observations
+        (None to record nothing).
+        """
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+        self._recorder = recorder
+        self._count = itertools.count(1)
+        self._last_obs = None
+        self.status = None
+
+    @classmethod
+    async def from_controller(cls, controller, timeout=None, recorder=None):
+        """Returns a protocol using the connection of a pysc2
+        RemoteController, which should not be used while the protocol is
+        waiting for a response.
+        """
+        sock = controller._client._sock.sock.dup()
+        reader, writer = await asyncio.open_connection(sock=sock)
+        async_protocol = cls(reader, writer, timeout, recorder)
+        async_protocol.status = controller.status
+        return async_protocol
+
+    def close(self):
+        try:
+            self._writer.close()
+        except RuntimeError:  # the event loop has already been closed
+            pass
+
+    async def send(self, **kwargs):
+        """Send a single request given as a keyword argument, and return the
+        response, e.g. await send(ping=sc_pb.RequestPing()).
+        """
+        assert len(kwargs) == 1, "Must make a single request."
+        (response,) = await self.send_requests(list(kwargs.items()))
+        return response
+
+    async def send_requests(self, requests):
+        """Write requests, given as (name, request) pairs, back-to-back and
+        then read their responses, which are returned.
+
+        As by pysc2's controller, "Game has already ended" errors of
+        requests other than observations are suppressed while in game, in
+        which case their response is None, and stub observations at the
+        end of a game are replaced by the previous observation.
+        """
+        prev_status = self.status
+        reqs = []
+        for name, request in requests:
+            req = sc_pb.Request(**{name: request})
+            req.id = next(self._count)
+            reqs.append((name, req))
+            if name == "action" and self._recorder is not None:
+                self._recorder.write_actions(request)
+        try:
+            response_strs = await asyncio.wait_for(
+                self._exchange(reqs), self._timeout
+            )
+        except asyncio.TimeoutError:
+            raise protocol.ConnectionError(
+                "Timed out after {} seconds waiting for SC2.".format(
+                    self._timeout
+                )
+            )
+
+        responses = []
+        error = None
+        for (name, req), response_str in zip(reqs, response_strs):
+            try:
+                responses.append(self._parse_response(name, req, response_str))
+            except protocol.ProtocolError as e:
+                if not (
+                    name != "observation"
+                    and prev_status == protocol.Status.in_game
+                    and "Game has already ended" in str(e)
+                ):
+                    error = error or e
+                responses.append(None)
+        if error is not None:
+            raise error
+        return responses
+
+    async def _exchange(self, reqs):
+        """Returns the serialised responses to requests."""
+        name = ", ".join(name for name, _ in reqs)
+        try:
+            for _, req in reqs:
+                await self._write_message(req.SerializeToString())
+            return [await self._read_message() for _ in reqs]
+        except (asyncio.IncompleteReadError, OSError) as e:
+            raise protocol.ConnectionError(
+                "Error during {}: {}".format(name, e)
+            )
+
+    def _parse_response(self, name, req, response_str):
+        if not response_str:
+            raise protocol.ProtocolError("Got an empty response from SC2.")
+        res = sc_pb.Response.FromString(response_str)
+        if not res.HasField("status"):
+            raise protocol.ProtocolError(
+                "Got an incomplete response without a status."
+            )
+        self.status = protocol.Status(res.status)
+        if res.HasField("id") and res.id != req.id:
+            raise protocol.ConnectionError(
+                "Error during {}: Got a response with a different id".format(
+                    name
+                )
+            )
+        if res.error:
+            raise protocol.ProtocolError(
+                "Error in RPC response: {}".format("\n".join(res.error))
+            )
+        response = getattr(res, name)
+        if name == "observation":
+            response = self._replace_stub_observation(response)
+            if self._recorder is not None:
+                self._recorder.write_observation(response)
+        return response
+
+    def _replace_stub_observation(self, obs):
+        """Replace the stub observation sent at the end of a game with the
+        previous one, like RemoteController.observe.
+        """
+        if obs.observation.game_loop != 2**32 - 1:
+            self._last_obs = obs
+            return obs
+        if not obs.player_result or self._last_obs is None:
+            raise protocol.ProtocolError("Unexpected stub observation.")
+        new_obs = sc_pb.ResponseObservation()
+        new_obs.CopyFrom(self._last_obs)
+        del new_obs.actions[:]
+        new_obs.actions.extend(obs.actions)
+        new_obs.player_result.extend(obs.player_result)
+        self._last_obs = None
+        return new_obs
+
+    async def actions(self, req_actions):
+        return await self.send(action=req_actions)
+
+    async def step(self, count=1):
+        return await self.send(step=sc_pb.RequestStep(count=count))
+
+    async def debug(self, debug_commands):
+        return await self.send(debug=sc_pb.RequestDebug(debug=debug_commands))
+
+    async def observe(self):
+        return await self.send(observation=sc_pb.RequestObservation())
+
+    async def _write_message(self, payload):
+        await self._write_frame(_BINARY, payload)
+
+    async def _write_frame(self, opcode, payload):
+        # Frames sent by clients must be masked
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 2**16:
+            header.append(0x80 | 126)
+            header += struct.pack("!H", length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack("!Q", length)
+        mask = os.urandom(4)
+        header += mask
+        self._writer.write(bytes(header) + _apply_mask(payload, mask))
+        await self._writer.drain()
+
+    async def _read_message(self):
+        fragments = []
+        while True:
+            first, second = await self._reader.readexactly(2)
+            fin = first & 0x80
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                (length,) = struct.unpack(
+                    "!H", await self._reader.readexactly(2)
+                )
+            elif length == 127:
+                (length,) = struct.unpack(
+                    "!Q", await self._reader.readexactly(8)
+                )
+            mask = None
+            if second & 0x80:
+                mask = await self._reader.readexactly(4)
+            payload = await self._reader.readexactly(length)
+            if mask is not None:
+                payload = _apply_mask(payload, mask)
+
+            if opcode == _PING:
+                await self._write_frame(_PONG, payload)
+            elif opcode == _CLOSE:
+                raise protocol.ConnectionError("Connection closed by SC2.")
+            elif opcode < _CLOSE:  # data frames
+                fragments.append(payload)
+                if fin:
+                    return b"".join(fragments)
+
+
+def _apply_mask(payload, mask):
+    """(Un)mask a websocket payload."""
+    if not payload:
+        return payload
+    data = np.frombuffer(payload, dtype=np.uint8)
+    mask = np.resize(np.frombuffer(mask, dtype=np.uint8), len(data))
+    return (data ^ mask).tobytes()
+
+
+class AsyncStarCraft2Env(StarCraft2Env):
+    """A StarCraft2Env whose reset and step, and the step_repeat and rollout
+    built on them, are coroutines.
+
+    Requests to StarCraft II are exchanged through the asyncio event loop
+    instead of blocking a thread, so that a single thread can drive many
+    environments concurrently, e.g. with asyncio.gather. Observations,
+    rewards and actions are computed by the code of StarCraft2Env, and all
+    of its methods that do not communicate with StarCraft II can be used
+    as usual. Launching and fully restarting StarCraft II, which start a
+    process, run in the default executor of the event loop.
+
+    The synchronous methods inherited from StarCraft2Env, such as
+    switch_map and full_restart, block the event loop while they
+    communicate with StarCraft II.
+    """
+
+    # The methods timed when timing is enabled, and their phases
+    _timed_methods = dict(
+        StarCraft2Env._timed_methods, _restart_async="restart"
+    )
+
+    def __init__(self, *args, request_timeout=120, **kwargs):
+        """Create an asynchronous StarCraft II environment, given the
+        arguments of StarCraft2Env and the timeout in seconds of requests
+        to StarCraft II (None to wait indefinitely), after which the
+        process is considered hung and fully restarted.
+        """
+        super().__init__(*args, **kwargs)
+        self.request_timeout = request_timeout
+        self._protocol = None
+
+    async def _connect(self):
+        """Take over the connection of the current controller."""
+        self._close_protocol()
+        self._protocol = await AsyncStarcraftProtocol.from_controller(
+            self._controller, self.request_timeout, self._recorder
+        )
+
+    async def _ensure_connected(self):
+        """Connect to the current StarCraft II process if the connection was
+        closed, e.g. by a synchronous full restart.
+        """
+        if self._protocol is None:
+            await self._connect()
+
+    def _close_protocol(self):
+        if self._protocol is not None:
+            self._protocol.close()
+            self._protocol = None
+
+    async def _run_blocking(self, func):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func)
+
+    def full_restart(self):
+        """Full restart. Closes the SC2 process and launches a new one,
+        blocking the event loop. The connection is reopened by the next
+        coroutine communicating with StarCraft II.
+        """
+        self._close_protocol()
+        super().full_restart()
+
+    async def full_restart_async(self):
+        """Full restart. Closes the SC2 process and launches a new one in
+        the default executor.
+        """
+        self._close_protocol()
+        await self._run_blocking(self.full_restart)
+        await self._connect()
+
+    async def reset(self):
+        """Reset the environment. Required after each full episode.
+        Returns initial observations and states.
+        """
+        self._episode_steps = 0
+        if self._recorder is not None:
+            self._recorder.write_reset()
+        reset_start = None
+        recycle_cause = self._get_recycle_cause()
+        if recycle_cause is not None:
+            self._close_protocol()
+            await self._run_blocking(
+                functools.partial(self._recycle, recycle_cause)
+            )
+        if self._controller is None:
+            # Launch StarCraft II
+            await self._run_blocking(self._launch)
+        await self._ensure_connected()
+        if self._restart_needed:
+            reset_start = self._get_reset_start()
+            await self._restart_async()
+
+        self._reset_episode_state()
+
+        try:
+            self._obs = await self._protocol.observe()
+            # Sometimes not all units have yet been created by SC2
+            while not self._init_units_from_obs():
+                if self._fast_reset_failed():
+                    await self._restart_async()
+                self._obs = await self._step_and_observe_async(1)
+        except (protocol.ProtocolError, protocol.ConnectionError):
+            await self.full_restart_async()
+            return await self.reset()
+
+        return self._finish_reset(reset_start)
+
+    async def _restart_async(self):
+        debug_commands, game_loops = self._get_restart_commands()
+        try:
+            # The map restarts the episode once all units are dead
+            await self._protocol.debug(debug_commands)
+            await self._protocol.step(game_loops)
+        except (protocol.ProtocolError, protocol.ConnectionError):
+            await self.full_restart_async()
+
+    async def _step_and_observe_async(self, count):
+        """Step the game and return the resulting observation."""
+        if self._pipeline_requests:
+            _, obs = await self._protocol.send_requests(
+                [
+                    ("step", sc_pb.RequestStep(count=count)),
+                    ("observation", sc_pb.RequestObservation()),
+                ]
+            )
+            return obs
+        await self._protocol.step(count)
+        return await self._protocol.observe()
+
+    async def _send_step_request_async(self, req_actions):
+        """Send the action request, step the game and return the resulting
+        observation, as _send_step_request does, timing the requests if
+        enabled.
+        """
+        perf_counter = time.perf_counter
+        start = perf_counter()
+        if self._pipeline_requests:
+            _, _, obs = await self._protocol.send_requests(
+                [
+                    ("action", req_actions),
+                    ("step", sc_pb.RequestStep(count=self._step_mul)),
+                    ("observation", sc_pb.RequestObservation()),
+                ]
+            )
+            end = perf_counter()
+            if self._timer is not None:
+                self._timer.record("sc2_requests", end - start)
+        else:
+            await self._protocol.actions(req_actions)
+            actions_end = perf_counter()
+            # Make step in SC2, i.e. apply actions
+            await self._protocol.step(self._step_mul)
+            step_end = perf_counter()
+            # Observe here so that we know if the episode is over.
+            obs = await self._protocol.observe()
+            end = perf_counter()
+            if self._timer is not None:
+                self._timer.record("sc2_actions", actions_end - start)
+                self._timer.record("sc2_step", step_end - actions_end)
+                self._timer.record("sc2_observe", end - step_end)
+        if self._supervisor.max_step_latency is not None:
+            self._supervisor.record_latency(end - start)
+        return obs
+
+    async def step(self, actions):
+        """A single environment step. Returns reward, terminated, info."""
+        return await self._step(self._build_action_request(actions))
+
+    async def _step(self, req_actions):
+        try:
+            await self._ensure_connected()
+            self._obs = await self._send_step_request_async(req_actions)
+        except (protocol.ProtocolError, protocol.ConnectionError):
+            await self.full_restart_async()
+            return 0, True, {}
+        return self._process_step()
+
+    async def step_repeat(self, actions, k, step_mul=None):
+        """Repeat the actions of the agents for k steps, stopping early if
+        the episode terminates. Returns the sum of the rewards, whether the
+        episode terminated and the info of the last step, as
+        StarCraft2Env.step_repeat does.
+        """
+        if k < 1:
+            raise ValueError("k must be at least 1, got {}.".format(k))
+        actions = [int(a) for a in actions]
+        env_step_mul = self._step_mul
+        if step_mul is not None:
+            self._step_mul = step_mul
+        total_reward = 0
+        try:
+            for n_steps in range(1, k + 1):
+                reward, terminated, info = await self.step(list(actions))
+                total_reward += reward
+                if terminated or n_steps == k:
+                    break
+                self._update_repeated_actions(actions)
+        finally:
+            self._step_mul = env_step_mul
+        info["repeated_steps"] = n_steps
+        return total_reward, terminated, info
+
+    async def rollout(self, policy_fn, max_steps=None, out=None):
+        """Reset the environment and run an episode of at most max_steps
+        steps, choosing the actions with policy_fn. The episode is written
+        into arrays, which are returned as StarCraft2Env.rollout does.
+        """
+        out, max_steps = self._init_rollout(out, max_steps)
+        actions = out["actions"]
+
+        await self.reset()
+        t = 0
+        info = {}
+        while t < max_steps:
+            actions[t] = policy_fn(*self._write_rollout_observations(out, t))
+            reward, terminated, info = await self.step(actions[t])
+            out["reward"][t] = reward
+            out["terminated"][t] = terminated
+            t += 1
+            if terminated:
+                break
+        self._write_rollout_observations(out, t)
+
+        batch = dict(out)
+        batch["length"] = t
+        batch["info"] = info
+        return batch
+
+    def step_async(self, actions):
+        """Start an environment step as a task of the running event loop.
+        The step must be completed by awaiting step_wait, and no other
+        method of the environment should be called in between.
+        """
+        if self._step_future is not None:
+            raise RuntimeError("A step started by step_async is pending.")
+        req_actions = self._build_action_request(actions)
+        self._step_future = asyncio.ensure_future(self._step(req_actions))
+
+    async def step_wait(self):
+        """Wait for the step started by step_async to complete.
+        Returns reward, terminated, info.
+        """
+        if self._step_future is None:
+            raise RuntimeError("No step has been started by step_async.")
+        future, self._step_future = self._step_future, None
+        return await future
+
+    def close(self):
+        """Close StarCraft II."""
+        if self._step_future is not None:
+            self._step_future.cancel()
+            self._step_future = None
+        self._close_protocol()
+        super().close()
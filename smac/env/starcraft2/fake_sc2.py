@@ -0,0 +1,350 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import os
+
+import numpy as np
+
+from pysc2.run_configs import lib as run_configs_lib
+
+from s2clientprotocol import common_pb2 as sc_common
+from s2clientprotocol import raw_pb2 as r_pb
+from s2clientprotocol import sc2api_pb2 as sc_pb
+
+from smac.env.starcraft2.maps import get_map_params
+
+# The first unit type of the SMAC maps' custom ally units
+ALLY_UNIT_TYPE_BASE = 1970
+
+# The health and shield of the standard unit types of the SMAC maps
+UNIT_STATS = {
+    4: (200, 150),  # colossus
+    9: (30, 0),  # baneling
+    48: (45, 0),  # marine
+    51: (125, 0),  # marauder
+    54: (150, 0),  # medivac
+    73: (100, 50),  # zealot
+    74: (80, 80),  # stalker
+    98: (300, 0),  # spine crawler
+    105: (35, 0),  # zergling
+    107: (90, 0),  # hydralisk
+}
+
+# The standard unit types of the custom ally unit types of each map type,
+# in the order of their unit type ids
+MAP_TYPE_UNITS = {
+    "marines": [48],
+    "stalkers_and_zealots": [74, 73],
+    "colossi_stalkers_zealots": [4, 74, 73],
+    "MMM": [51, 48, 54],
+    "zealots": [73],
+    "hydralisks": [107],
+    "stalkers": [74],
+    "colossus": [4],
+    "bane": [9, 105],
+}
+
+# The standard unit types and numbers of the allies and enemies of each map,
+# to which maps must be added to be played with a FakeController
+MAP_UNITS = {
+    "3m": ([(48, 3)], [(48, 3)]),
+    "8m": ([(48, 8)], [(48, 8)]),
+    "25m": ([(48, 25)], [(48, 25)]),
+    "5m_vs_6m": ([(48, 5)], [(48, 6)]),
+    "8m_vs_9m": ([(48, 8)], [(48, 9)]),
+    "10m_vs_11m": ([(48, 10)], [(48, 11)]),
+    "27m_vs_30m": ([(48, 27)], [(48, 30)]),
+    "MMM": ([(51, 2), (48, 7), (54, 1)], [(51, 2), (48, 7), (54, 1)]),
+    "MMM2": ([(51, 2), (48, 7), (54, 1)], [(51, 3), (48, 8), (54, 1)]),
+    "2s3z": ([(74, 2), (73, 3)], [(74, 2), (73, 3)]),
+    "3s5z": ([(74, 3), (73, 5)], [(74, 3), (73, 5)]),
+    "3s5z_vs_3s6z": ([(74, 3), (73, 5)], [(74, 3), (73, 6)]),
+    "3s_vs_3z": ([(74, 3)], [(73, 3)]),
+    "3s_vs_4z": ([(74, 3)], [(73, 4)]),
+    "3s_vs_5z": ([(74, 3)], [(73, 5)]),
+    "1c3s5z": (
+        [(4, 1), (74, 3), (73, 5)],
+        [(4, 1), (74, 3), (73, 5)],
+    ),
+    "2m_vs_1z": ([(48, 2)], [(73, 1)]),
+    "corridor": ([(73, 6)], [(105, 24)]),
+    "6h_vs_8z": ([(107, 6)], [(73, 8)]),
+    "2s_vs_1sc": ([(74, 2)], [(98, 1)]),
+    "so_many_baneling": ([(73, 7)], [(9, 32)]),
+    "bane_vs_bane": ([(9, 4), (105, 20)], [(9, 4), (105, 20)]),
+    "2c_vs_64zg": ([(4, 2)], [(105, 64)]),
+}
+
+
+_MOVE, _ATTACK, _STOP, _HEAL = 16, 23, 4, 386
+_MEDIVAC = 54
+_SPEED = 0.2  # distance moved per game loop
+_RANGE = 6
+_DAMAGE = 10
+_COOLDOWN = 16  # game loops between attacks
+
+
+class FakeController(object):
+    """Stands in for a pysc2 RemoteController of a StarCraft II process,
+    so that StarCraft2Env can run without the game, e.g. for benchmarks.
+
+    Games are simulated crudely: the units of the map are spawned facing
+    each other, move, attack and heal as ordered, and are respawned once
+    all units are dead, as the trigger of the SMAC maps does. The
+    observations and game info are protobufs like those of the game.
+    """
+
+    def __init__(self, seed=None, map_size=64):
+        """Create a fake controller.
+
+        Parameters
+        ----------
+        seed : int, optional
+            The random seed of the positions and health of spawned units
+            (default is None).
+        map_size : int, optional
+            The width and height of the map (default is 64).
+        """
+        self._rng = np.random.RandomState(seed)
+        self.map_size = map_size
+        self.map_name = None
+        self._units = {}  # tag -> raw_pb2.Unit
+        self._orders = {}  # tag -> (ability id, target)
+        self._next_tag = 1
+        self._game_loop = 0
+        self.status = None
+
+    # Game setup
+
+    def create_game(self, req_create_game):
+        map_path = req_create_game.local_map.map_path
+        self.map_name = os.path.splitext(os.path.basename(map_path))[0]
+        self._units.clear()
+        self._orders.clear()
+        self._game_loop = 0
+        self._spawn_units()
+        return sc_pb.ResponseCreateGame()
+
+    def join_game(self, req_join_game):
+        return sc_pb.ResponseJoinGame(player_id=1)
+
+    def game_info(self):
+        """Returns the game info of a fully pathable, flat map."""
+        size = self.map_size
+        game_info = sc_pb.ResponseGameInfo(map_name=self.map_name)
+        start_raw = game_info.start_raw
+        start_raw.map_size.x = start_raw.map_size.y = size
+        start_raw.playable_area.p0.x = start_raw.playable_area.p0.y = 0
+        start_raw.playable_area.p1.x = start_raw.playable_area.p1.y = size
+        start_raw.pathing_grid.bits_per_pixel = 1
+        start_raw.pathing_grid.size.x = start_raw.pathing_grid.size.y = size
+        start_raw.pathing_grid.data = np.packbits(
+            np.ones((size, size), dtype=bool), axis=1
+        ).tobytes()
+        start_raw.terrain_height.bits_per_pixel = 8
+        start_raw.terrain_height.size.x = size
+        start_raw.terrain_height.size.y = size
+        start_raw.terrain_height.data = bytes(size * size)
+        return game_info
+
+    def leave(self):
+        self.map_name = None
+        self._units.clear()
+        self._orders.clear()
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def ping(self):
+        return sc_pb.ResponsePing(game_version="fake")
+
+    def save_replay(self):
+        return b""
+
+    # Playing
+
+    def actions(self, req_action):
+        for action in req_action.actions:
+            command = action.action_raw.unit_command
+            if command.ability_id == _STOP:
+                target = None
+            elif command.HasField("target_unit_tag"):
+                target = command.target_unit_tag
+            else:
+                target = (
+                    command.target_world_space_pos.x,
+                    command.target_world_space_pos.y,
+                )
+            for tag in command.unit_tags:
+                self._orders[tag] = (command.ability_id, target)
+        return sc_pb.ResponseAction()
+
+    def step(self, count=1):
+        self._game_loop += count
+        for tag, (ability_id, target) in list(self._orders.items()):
+            unit = self._units.get(tag)
+            if unit is None:
+                del self._orders[tag]
+            elif ability_id == _MOVE:
+                self._move(unit, target, _SPEED * count)
+            elif ability_id in (_ATTACK, _HEAL):
+                self._attack(unit, self._units.get(target), ability_id)
+        for unit in self._units.values():
+            unit.weapon_cooldown = max(unit.weapon_cooldown - count, 0)
+        for tag in [t for t, u in self._units.items() if u.health <= 0]:
+            del self._units[tag]
+        if not self._units and self.map_name is not None:
+            self._spawn_units()
+        return sc_pb.ResponseStep()
+
+    def observe(self):
+        obs = sc_pb.ResponseObservation()
+        obs.observation.game_loop = self._game_loop
+        obs.observation.raw_data.units.extend(self._units.values())
+        return obs
+
+    def debug(self, debug_commands):
+        for command in debug_commands:
+            if command.HasField("kill_unit"):
+                for tag in command.kill_unit.tag:
+                    if tag in self._units:
+                        self._units[tag].health = 0
+            elif command.HasField("create_unit"):
+                create = command.create_unit
+                for _ in range(create.quantity):
+                    self._add_unit(
+                        create.owner,
+                        create.unit_type,
+                        create.pos.x,
+                        create.pos.y,
+                    )
+        return sc_pb.ResponseDebug()
+
+    # Simulation
+
+    def _spawn_units(self):
+        map_type = get_map_params(self.map_name)["map_type"]
+        allies, enemies = MAP_UNITS[self.map_name]
+        center = self.map_size / 2
+        for owner, units in ((1, allies), (2, enemies)):
+            for standard_type, n_units in units:
+                if owner == 1:
+                    unit_type = ALLY_UNIT_TYPE_BASE + MAP_TYPE_UNITS[
+                        map_type
+                    ].index(standard_type)
+                else:
+                    unit_type = standard_type
+                x = center + (-3 if owner == 1 else 3)
+                for _ in range(n_units):
+                    self._add_unit(
+                        owner,
+                        unit_type,
+                        x + self._rng.uniform(-2, 2),
+                        center + self._rng.uniform(-4, 4),
+                    )
+
+    def _standard_unit_type(self, unit_type):
+        """Returns the standard unit type of a possibly custom unit type."""
+        units = MAP_TYPE_UNITS[get_map_params(self.map_name)["map_type"]]
+        index = unit_type - ALLY_UNIT_TYPE_BASE
+        if 0 <= index < len(units):
+            return units[index]
+        return unit_type
+
+    def _add_unit(self, owner, unit_type, x, y):
+        standard_type = self._standard_unit_type(unit_type)
+        health, shield = UNIT_STATS.get(standard_type, (50, 0))
+        unit = r_pb.Unit(
+            display_type=r_pb.Visible,
+            alliance=r_pb.Self if owner == 1 else r_pb.Enemy,
+            tag=self._next_tag,
+            unit_type=unit_type,
+            owner=owner,
+            pos=sc_common.Point(x=x, y=y, z=0),
+            health=health,
+            health_max=health,
+            shield=shield,
+            shield_max=shield,
+            energy=200 if standard_type == _MEDIVAC else 0,
+            energy_max=200 if standard_type == _MEDIVAC else 0,
+        )
+        self._units[unit.tag] = unit
+        self._next_tag += 1
+
+    def _move(self, unit, target, distance):
+        dx = target[0] - unit.pos.x
+        dy = target[1] - unit.pos.y
+        remaining = math.hypot(dx, dy)
+        if remaining <= distance:
+            unit.pos.x, unit.pos.y = target
+            del self._orders[unit.tag]
+        else:
+            unit.pos.x += dx / remaining * distance
+            unit.pos.y += dy / remaining * distance
+
+    def _attack(self, unit, target, ability_id):
+        if target is None or target.health <= 0:
+            del self._orders[unit.tag]
+            return
+        distance = math.hypot(
+            target.pos.x - unit.pos.x, target.pos.y - unit.pos.y
+        )
+        if distance > _RANGE or unit.weapon_cooldown > 0:
+            return
+        unit.weapon_cooldown = _COOLDOWN
+        if ability_id == _HEAL:
+            target.health = min(target.health + _DAMAGE, target.health_max)
+            return
+        damage = _DAMAGE
+        if target.shield > 0:
+            absorbed = min(target.shield, damage)
+            target.shield -= absorbed
+            damage -= absorbed
+        target.health = max(target.health - damage, 0)
+
+
+class FakeProcess(object):
+    """Stands in for a StarCraft II process, holding a FakeController."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.port = None
+        self.running = True
+
+    def close(self):
+        self.running = False
+
+
+class FakeRunConfig(object):
+    """A pysc2 run config starting FakeProcesses instead of StarCraft II.
+    Pass it to StarCraft2Env through its run_config argument to run the
+    environment without the game.
+    """
+
+    def __init__(self, seed=None, map_size=64):
+        """Create a fake run config. The arguments are passed to the
+        FakeController of every started process, whose seed is offset by
+        the number of processes started before.
+        """
+        self.seed = seed
+        self.map_size = map_size
+        self.version = run_configs_lib.Version("fake", 0, None, None)
+        self.data_dir = ""
+        self._n_started = 0
+
+    def start(self, **kwargs):
+        seed = None if self.seed is None else self.seed + self._n_started
+        self._n_started += 1
+        return FakeProcess(FakeController(seed, self.map_size))
+
+    def map_data(self, map_name, players=None):
+        # Distinguishes the cached map info of different map sizes
+        return "fake {}".format(self.map_size).encode()
+
+    def save_replay(self, replay_data, replay_dir, prefix=None):
+        return ""
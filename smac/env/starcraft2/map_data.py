@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import struct
+import threading
+import time
+
+from absl import logging
+
+try:
+    from multiprocessing import resource_tracker
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+# The contents of a shared memory segment are preceded by their length,
+# which is written last so that partially written segments are ignored
+_HEADER = struct.Struct("<Q")
+
+
+class MapDataCache(object):
+    """Process-wide cache of the contents of map files.
+
+    Every launch of StarCraft II sends the map file to the game, so that
+    environments launching or fully restarting often read the same files
+    repeatedly. Map files are read from disk once per process and, if
+    requested, stored in a shared memory segment named after the map path,
+    size and modification time, from which the other processes of the host
+    read them instead of the disk. Shared memory segments outlive the
+    processes that created them, until they are removed by unlink or the
+    host restarts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._segments = {}
+        self.hits = 0
+        self.shared_memory_hits = 0
+        self.misses = 0
+        self.load_time = 0.0
+
+    def get(self, run_config, map_path, use_shared_memory=False):
+        """Returns the contents of a map file, given its path relative to
+        the maps directory of a pysc2 run config.
+        """
+        start = time.perf_counter()
+        path = os.path.join(run_config.data_dir, "Maps", map_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Let pysc2 look for the map and report it missing
+            return run_config.map_data(map_path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            map_data = self._data.get(key)
+            if map_data is not None:
+                self.hits += 1
+            elif use_shared_memory and shared_memory is not None:
+                map_data = self._read_segment(key)
+                if map_data is not None:
+                    self.shared_memory_hits += 1
+            if map_data is None:
+                self.misses += 1
+                map_data = run_config.map_data(map_path)
+                if use_shared_memory and shared_memory is not None:
+                    self._write_segment(key, map_data)
+            self._data[key] = map_data
+            self.load_time += time.perf_counter() - start
+        return map_data
+
+    def get_stats(self):
+        """Returns the number of hits and misses of the cache and the total
+        time spent loading maps, in seconds.
+        """
+        with self._lock:
+            return {
+                "map_data_hits": self.hits,
+                "map_data_shared_memory_hits": self.shared_memory_hits,
+                "map_data_misses": self.misses,
+                "map_data_load_time": self.load_time,
+            }
+
+    def unlink(self):
+        """Remove the shared memory segments of the maps loaded by this
+        process, so that the other processes can no longer read them.
+        """
+        with self._lock:
+            for key in self._data:
+                segment = self._segments.pop(key, None)
+                if segment is None:
+                    segment = self._open_segment(key)
+                if segment is not None:
+                    segment.close()
+                    if os.name == "posix":
+                        # Balances the unregistration done by unlink
+                        resource_tracker.register(
+                            segment._name, "shared_memory"
+                        )
+                    try:
+                        segment.unlink()
+                    except FileNotFoundError:
+                        pass
+
+    @staticmethod
+    def _segment_name(key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return "smac_map_" + digest
+
+    def _open_segment(self, key, size=0):
+        """Open the shared memory segment of a map, creating it with the
+        given size if positive. Returns None if it could not be opened.
+        """
+        try:
+            segment = shared_memory.SharedMemory(
+                self._segment_name(key), create=size > 0, size=size
+            )
+        except (FileNotFoundError, FileExistsError):
+            return None
+        except OSError as e:
+            logging.warning("Could not open shared map data: {}".format(e))
+            return None
+        if os.name == "posix":
+            # The segment is shared with other processes and must not be
+            # removed when this one exits
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+    def _read_segment(self, key):
+        segment = self._open_segment(key)
+        if segment is None:
+            return None
+        (length,) = _HEADER.unpack_from(segment.buf)
+        map_data = None
+        if length == key[1] and len(segment.buf) >= _HEADER.size + length:
+            start = _HEADER.size
+            map_data = bytes(segment.buf[start : start + length])  # noqa
+        segment.close()
+        return map_data
+
+    def _write_segment(self, key, map_data):
+        segment = self._open_segment(key, size=_HEADER.size + len(map_data))
+        if segment is None:
+            return  # another process is writing it
+        start = _HEADER.size
+        segment.buf[start : start + len(map_data)] = map_data  # noqa
+        _HEADER.pack_into(segment.buf, 0, len(map_data))
+        self._segments[key] = segment
+
+
+# The cache shared by all environments of this process
+map_data_cache = MapDataCache()
@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+from absl import logging
+
+MAP_INFO_FIELDS = (
+    "max_distance_x",
+    "max_distance_y",
+    "map_x",
+    "map_y",
+    "pathing_grid",
+    "terrain_height",
+)
+
+# Decoded map information shared by all environments of this process
+_memory_cache = {}
+
+
+def decode_pathing_grid(pathing_grid, map_x, map_y):
+    """Decode the pathing grid of a map from its protobuf image data."""
+    data = np.frombuffer(pathing_grid.data, dtype=np.uint8)
+    if pathing_grid.bits_per_pixel == 1:
+        bits = np.unpackbits(data.reshape(map_x, int(map_y / 8)), axis=1)
+        return np.ascontiguousarray(bits.astype(bool).T)
+    grid = data.astype(bool).reshape(map_x, map_y)
+    return np.ascontiguousarray(np.invert(np.flip(grid.T, axis=1)))
+
+
+def decode_terrain_height(terrain_height, map_x, map_y):
+    """Decode the terrain height of a map from its protobuf image data,
+    scaled to [0, 1].
+    """
+    data = np.frombuffer(terrain_height.data, dtype=np.uint8)
+    height = np.flip(data.reshape(map_x, map_y).T, 1) / 255
+    return np.ascontiguousarray(height)
+
+
+def decode_map_info(game_info):
+    """Returns the map size, playable area, pathing grid and terrain height
+    of a ResponseGameInfo as a dictionary.
+    """
+    map_info = game_info.start_raw
+    map_play_area_min = map_info.playable_area.p0
+    map_play_area_max = map_info.playable_area.p1
+    map_x = map_info.map_size.x
+    map_y = map_info.map_size.y
+    return {
+        "max_distance_x": map_play_area_max.x - map_play_area_min.x,
+        "max_distance_y": map_play_area_max.y - map_play_area_min.y,
+        "map_x": map_x,
+        "map_y": map_y,
+        "pathing_grid": decode_pathing_grid(
+            map_info.pathing_grid, map_x, map_y
+        ),
+        "terrain_height": decode_terrain_height(
+            map_info.terrain_height, map_x, map_y
+        ),
+    }
+
+
+def map_info_key(map_name, game_version, map_data):
+    """Returns the cache key of the information of a map, which depends on
+    the map name, the game version and the contents of the map file.
+    """
+    digest = hashlib.sha1(map_data).hexdigest()[:16]
+    return "{}_{}_{}".format(map_name, game_version, digest)
+
+
+class MapInfoCache(object):
+    """Cache of decoded map information.
+
+    Entries are kept in memory for the lifetime of the process and, if a
+    cache directory is given, stored there as .npz files so that other
+    processes can reuse them. The cached arrays are read-only.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+
+    def get(self, key):
+        """Returns the map information cached under key, or None."""
+        map_info = _memory_cache.get(key)
+        if map_info is None and self.cache_dir is not None:
+            map_info = self._load(key)
+            if map_info is not None:
+                _memory_cache[key] = map_info
+        return map_info
+
+    def put(self, key, map_info):
+        """Cache map information under key."""
+        for name in ("pathing_grid", "terrain_height"):
+            map_info[name].setflags(write=False)
+        _memory_cache[key] = map_info
+        if self.cache_dir is not None:
+            self._save(key, map_info)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                map_info = {name: data[name] for name in data.files}
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            logging.warning(
+                "Ignoring unreadable map cache file {}: {}".format(path, e)
+            )
+            return None
+        if set(map_info) != set(MAP_INFO_FIELDS):
+            return None
+        for name in MAP_INFO_FIELDS:
+            if map_info[name].ndim == 0:
+                map_info[name] = map_info[name].item()
+            else:
+                map_info[name].setflags(write=False)
+        return map_info
+
+    def _save(self, key, map_info):
+        # Write to a temporary file that is then renamed, so that concurrent
+        # processes never read a partially written file
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.cache_dir, prefix=key, suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, **map_info)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            logging.warning(
+                "Could not write map cache file {}: {}".format(
+                    self._path(key), e
+                )
+            )
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import portpicker
+from absl import logging
+
+from pysc2 import run_configs
+
+
+class StarCraft2ProcessPool(object):
+    """A pool of pre-launched StarCraft II processes.
+
+    Processes are launched concurrently on background threads, and every
+    process handed out by acquire is replaced by a newly launched one, so
+    that environments, including those recovering from a crash through
+    full_restart, can start playing without waiting for StarCraft II to
+    boot. Pass the pool to StarCraft2Env through its process_pool argument.
+
+    Every process listens on its own port. Ports are picked by the pool
+    under a lock and are not handed out again while a process using them
+    is alive, so that concurrent launches do not collide.
+    """
+
+    def __init__(
+        self,
+        size,
+        game_version=None,
+        window_size=(1920, 1200),
+        max_concurrent_launches=None,
+    ):
+        """Create a pool of StarCraft II processes.
+
+        Parameters
+        ----------
+        size : int
+            The number of ready processes to keep in the pool.
+        game_version : str, optional
+            StarCraft II game version of the processes (default is None, in
+            which case the latest installed version is used).
+        window_size : tuple, optional
+            The size of the StarCraft II windows (default is (1920, 1200)).
+        max_concurrent_launches : int, optional
+            The maximum number of processes launched at the same time
+            (default is None, in which case all processes of the pool may
+            be launched at once).
+        """
+        self.size = size
+        self.game_version = game_version
+        self.window_size = window_size
+        self.run_config = run_configs.get(version=game_version)
+        self._lock = threading.Lock()
+        self._ports = {}  # port -> process using it
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_launches or size
+        )
+        self._launches = collections.deque(
+            self._executor.submit(self._start_process) for _ in range(size)
+        )
+        self._closed = False
+
+    def _pick_port(self):
+        with self._lock:
+            # Ports of closed processes can be picked again
+            for port, process in list(self._ports.items()):
+                if process is not None and process.port != port:
+                    del self._ports[port]
+            while True:
+                port = portpicker.pick_unused_port()
+                if port not in self._ports:
+                    self._ports[port] = None
+                    return port
+
+    def _start_process(self):
+        port = self._pick_port()
+        try:
+            process = self.run_config.start(
+                window_size=self.window_size, want_rgb=False, port=port
+            )
+        except Exception:
+            with self._lock:
+                del self._ports[port]
+            raise
+        with self._lock:
+            self._ports[port] = process
+        return process
+
+    def acquire(self):
+        """Returns a ready StarCraft II process, which then belongs to the
+        caller, and launches a replacement for it. Waits for a process to
+        be ready if none is.
+        """
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("The process pool is closed.")
+                ready = [f for f in self._launches if f.done()]
+                launch = ready[0] if ready else self._launches[0]
+                self._launches.remove(launch)
+                self._launches.append(
+                    self._executor.submit(self._start_process)
+                )
+            process = launch.result()
+            if process.running:
+                return process
+            # The process died while waiting in the pool
+            logging.warning("Discarding a dead StarCraft II process.")
+            process.close()
+
+    def close(self):
+        """Close the processes that have not been acquired."""
+        with self._lock:
+            self._closed = True
+            launches = list(self._launches)
+            self._launches.clear()
+        self._executor.shutdown(wait=True)
+        for launch in launches:
+            if launch.exception() is None:
+                launch.result().close()
@@ -0,0 +1,277 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import gzip
+import struct
+
+import numpy as np
+
+from pysc2.run_configs import lib as run_configs_lib
+
+from s2clientprotocol import sc2api_pb2 as sc_pb
+
+
+# Record kinds of a stream file
+_HEADER = 0
+_MAP = 1
+_GAME_INFO = 2
+_RESET = 3
+_AGENT_ACTIONS = 4
+_ACTIONS = 5
+_OBSERVATION = 6
+
+_FORMAT = b"SMAC stream 1"
+# The kind and length preceding the payload of every record
+_RECORD = struct.Struct("<BI")
+
+
+class StreamRecorder(object):
+    """Writes what an environment exchanges with StarCraft II into a
+    gzipped stream file: the maps played, the game info of every game, the
+    actions of the agents and the requests sent for them, and every
+    observation, in the order in which they happen.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, "wb")
+        self._write(_HEADER, _FORMAT)
+
+    def _write(self, kind, payload):
+        self._file.write(_RECORD.pack(kind, len(payload)))
+        self._file.write(payload)
+
+    def write_map(self, map_name):
+        self._write(_MAP, map_name.encode())
+
+    def write_game_info(self, game_info):
+        self._write(_GAME_INFO, game_info.SerializeToString())
+
+    def write_reset(self):
+        self._write(_RESET, b"")
+
+    def write_agent_actions(self, actions):
+        self._write(
+            _AGENT_ACTIONS, np.asarray(actions, dtype=np.int64).tobytes()
+        )
+
+    def write_actions(self, req_actions):
+        self._write(_ACTIONS, req_actions.SerializeToString())
+
+    def write_observation(self, obs):
+        self._write(_OBSERVATION, obs.SerializeToString())
+
+    def close(self):
+        self._file.close()
+
+
+def read_stream(path):
+    """Returns the records of a stream file as (kind, payload) tuples."""
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+    records = []
+    offset = 0
+    while offset < len(data):
+        kind, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        records.append((kind, data[offset : offset + length]))  # noqa
+        offset += length
+    if not records or records[0] != (_HEADER, _FORMAT):
+        raise ValueError("{} is not a SMAC stream file.".format(path))
+    return records[1:]
+
+
+class RecordingController(object):
+    """Wraps a controller, recording the game info of the games it joins,
+    the action requests it sends and the observations it receives.
+    """
+
+    def __init__(self, controller, recorder):
+        self._controller = controller
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._controller, name)
+
+    def join_game(self, req_join_game):
+        response = self._controller.join_game(req_join_game)
+        # Recorded even if the environment has cached the map info
+        self._recorder.write_game_info(self._controller.game_info())
+        return response
+
+    def actions(self, req_actions):
+        self._recorder.write_actions(req_actions)
+        return self._controller.actions(req_actions)
+
+    def observe(self, *args, **kwargs):
+        obs = self._controller.observe(*args, **kwargs)
+        self._recorder.write_observation(obs)
+        return obs
+
+
+class ReplayController(object):
+    """Stands in for the controller of a StarCraft II process, serving the
+    game info and observations of a stream file in the order in which they
+    were recorded.
+
+    Action requests are checked against the recorded ones, so that a
+    replay fails with a ValueError as soon as the environment sends
+    different commands to the game than it did when recording.
+    """
+
+    def __init__(self, records):
+        """Create a replay controller, given the game infos, action requests
+        and observations of a stream, each in a deque, which are consumed
+        by this controller.
+        """
+        self._records = records
+        self._n_actions = 0
+        self.status = None
+
+    def _next(self, kind):
+        try:
+            return self._records[kind].popleft()
+        except IndexError:
+            raise ValueError("The recording has ended.")
+
+    def create_game(self, req_create_game):
+        return sc_pb.ResponseCreateGame()
+
+    def join_game(self, req_join_game):
+        self._game_info = sc_pb.ResponseGameInfo.FromString(
+            self._next(_GAME_INFO)
+        )
+        return sc_pb.ResponseJoinGame(player_id=1)
+
+    def game_info(self):
+        return self._game_info
+
+    def actions(self, req_actions):
+        self._n_actions += 1
+        if req_actions.SerializeToString() != self._next(_ACTIONS):
+            raise ValueError(
+                "Action request {} differs from the recording.".format(
+                    self._n_actions
+                )
+            )
+        return sc_pb.ResponseAction()
+
+    def observe(self, *args, **kwargs):
+        return sc_pb.ResponseObservation.FromString(self._next(_OBSERVATION))
+
+    def step(self, count=1):
+        return sc_pb.ResponseStep()
+
+    def debug(self, debug_commands):
+        return sc_pb.ResponseDebug()
+
+    def leave(self):
+        pass
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def save_replay(self):
+        return b""
+
+
+class ReplayRunConfig(object):
+    """A pysc2 run config starting FakeProcesses whose controllers replay a
+    stream file recorded with the record_path argument of StarCraft2Env.
+    The stream is read into memory beforehand, so that replaying performs
+    no I/O.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        records = read_stream(path)
+        self.version = run_configs_lib.Version("replay", 0, None, None)
+        self.data_dir = ""
+        # The maps, resets and agent actions, which drive the replay
+        self.events = [
+            (kind, payload)
+            for kind, payload in records
+            if kind in (_MAP, _RESET, _AGENT_ACTIONS)
+        ]
+        self._records = {
+            kind: collections.deque(
+                payload for k, payload in records if k == kind
+            )
+            for kind in (_GAME_INFO, _ACTIONS, _OBSERVATION)
+        }
+        game_infos = self._records[_GAME_INFO]
+        self._map_data = game_infos[0] if game_infos else b""
+
+    def start(self, **kwargs):
+        # Imported here as the fake controller is only needed for replays
+        from smac.env.starcraft2.fake_sc2 import FakeProcess
+
+        return FakeProcess(ReplayController(self._records))
+
+    def map_data(self, map_name, players=None):
+        # Keys the map info cache by the recorded game info
+        return self._map_data
+
+    def save_replay(self, replay_data, replay_dir, prefix=None):
+        return ""
+
+
+def replay(path, step_callback=None, **env_args):
+    """Replay a stream file in a new StarCraft2Env, without StarCraft II.
+
+    The environment is reset and stepped with the recorded agent actions,
+    and switched to the recorded maps, as when recording. Before every
+    step the observations, state and available actions are computed, as
+    agents would.
+
+    Parameters
+    ----------
+    path : str
+        The stream file.
+    step_callback : callable, optional
+        A function called as step_callback(env, reward, terminated, info)
+        after every step, e.g. to compare the observations with those of a
+        reference implementation (default is None).
+    **env_args
+        Arguments of the StarCraft2Env, which should be those of the
+        recording environment except for the map name.
+
+    Returns
+    -------
+    dict
+        The statistics of the environment at the end of the replay.
+    """
+    # Imported here as starcraft2 imports this module
+    from smac.env.starcraft2.starcraft2 import StarCraft2Env
+
+    run_config = ReplayRunConfig(path)
+    env = None
+    try:
+        for kind, payload in run_config.events:
+            if kind == _MAP:
+                map_name = payload.decode()
+                if env is None:
+                    env = StarCraft2Env(
+                        map_name=map_name, run_config=run_config, **env_args
+                    )
+                elif map_name != env.map_name:
+                    env.switch_map(map_name)
+            elif kind == _RESET:
+                env.reset()
+            else:
+                env.get_obs()
+                env.get_state()
+                env.get_avail_actions()
+                actions = np.frombuffer(payload, dtype=np.int64)
+                reward, terminated, info = env.step(actions.tolist())
+                if step_callback is not None:
+                    step_callback(env, reward, terminated, info)
+        return env.get_stats() if env is not None else {}
+    finally:
+        if env is not None:
+            env.close()
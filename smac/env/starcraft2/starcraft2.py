@@ -4,11 +4,28 @@ from __future__ import print_function
 
 from smac.env.multiagentenv import MultiAgentEnv
 from smac.env.starcraft2.maps import get_map_params
+from smac.env.starcraft2.map_data import map_data_cache
+from smac.env.starcraft2.recording import (
+    RecordingController,
+    StreamRecorder,
+)
+from smac.env.starcraft2.supervisor import ProcessSupervisor
+from smac.env.starcraft2.timing import PhaseTimer
+from smac.env.starcraft2.map_info import (
+    MapInfoCache,
+    decode_map_info,
+    map_info_key,
+)
 
 import atexit
+import functools
+import inspect
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from warnings import warn
 from operator import attrgetter
-from copy import deepcopy
 import numpy as np
 import enum
 import math
@@ -17,6 +34,7 @@ from absl import logging
 from pysc2 import maps
 from pysc2 import run_configs
 from pysc2.lib import protocol
+from pysc2.lib import remote_controller
 
 from s2clientprotocol import common_pb2 as sc_common
 from s2clientprotocol import sc2api_pb2 as sc_pb
@@ -58,6 +76,130 @@ class Direction(enum.IntEnum):
     WEST = 3
 
 
+def _copy_cached(value):
+    """Returns a copy of a memoised value that callers may modify."""
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, list):
+        return [_copy_cached(v) for v in value]
+    return value
+
+
+def step_cached(func=None, shared=False):
+    """Memoise the result of an environment method for the current step.
+
+    The result is computed at most once per environment step for each set of
+    arguments, however they are passed, e.g. ``get_obs_agent(0)`` and
+    ``get_obs_agent(agent_id=0)`` share an entry. The cache is keyed on the
+    episode step counter and is also cleared explicitly by ``step``,
+    ``reset`` and ``full_restart``.
+
+    Every caller receives a copy of the memoised result, so that modifying
+    it does not affect other callers. Private methods only used internally
+    may pass ``shared=True`` to receive the memoised arrays themselves,
+    which are then made read-only.
+
+    Methods accepting an ``out`` array copy a memoised result into it, or
+    otherwise compute straight into it without memoising caller memory.
+    """
+    if func is None:
+        return functools.partial(step_cached, shared=shared)
+
+    signature = inspect.signature(func)
+    n_params = len(
+        [name for name in signature.parameters if name not in ("self", "out")]
+    )
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if kwargs or len(args) != n_params:
+            # Normalise keyword and positional arguments into one key
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            kwargs = {}
+            if "out" in bound.arguments:
+                kwargs["out"] = bound.arguments.pop("out")
+            args = tuple(bound.arguments.values())[1:]
+        out = kwargs.get("out")
+        if self._step_cache_key != self._episode_steps:
+            self._clear_step_cache()
+        key = (func.__name__,) + args
+        if key in self._step_cache:
+            self._step_cache_hits += 1
+            value = self._step_cache[key]
+            if out is not None:
+                out[...] = value
+                return out
+        else:
+            self._step_cache_misses += 1
+            if out is not None:
+                return func(self, *args, out=out)
+            value = self._step_cache[key] = func(self, *args)
+            if shared and isinstance(value, np.ndarray):
+                value.setflags(write=False)
+        return value if shared else _copy_cached(value)
+
+    return wrapper
+
+
+class UnitArrays(object):
+    """Structure-of-arrays store of the units of a scenario.
+
+    Every field is a contiguous array with one entry per unit, holding the
+    allies in unit id order followed by the enemies in unit id order. The
+    ``ally`` and ``enemy`` slices select either group. The arrays are
+    replaced rather than modified by ``update``, so references to the
+    arrays of a previous step remain valid.
+    """
+
+    fields = (
+        "x",
+        "y",
+        "health",
+        "health_max",
+        "shield",
+        "weapon_cooldown",
+        "energy",
+        "unit_type",
+    )
+
+    def __init__(self, n_agents, n_enemies):
+        self.n_units = n_agents + n_enemies
+        self.ally = slice(0, n_agents)
+        self.enemy = slice(n_agents, self.n_units)
+        for field in self.fields:
+            setattr(self, field, np.zeros(self.n_units))
+        self.unit_type = np.zeros(self.n_units, dtype=np.int64)
+        self.alive = np.zeros(self.n_units, dtype=bool)
+
+    def update(self, units):
+        """Decode the given protobuf units, ordered like the arrays, in a
+        single pass.
+        """
+        data = np.array(
+            [
+                (
+                    unit.pos.x,
+                    unit.pos.y,
+                    unit.health,
+                    unit.health_max,
+                    unit.shield,
+                    unit.weapon_cooldown,
+                    unit.energy,
+                    unit.unit_type,
+                )
+                for unit in units
+            ],
+            dtype=np.float64,
+        )
+        # One contiguous row per field
+        data = np.ascontiguousarray(data.T)
+        for field, values in zip(self.fields, data):
+            setattr(self, field, values)
+        self.unit_type = self.unit_type.astype(np.int64)
+        self.alive = self.health > 0
+
+
 class StarCraft2Env(MultiAgentEnv):
     """The StarCraft II environment for decentralised multi-agent
     micromanagement scenarios.
@@ -96,6 +238,20 @@ class StarCraft2Env(MultiAgentEnv):
         heuristic_ai=False,
         heuristic_rest=False,
         debug=False,
+        vectorized=True,
+        map_cache_dir=None,
+        process_pool=None,
+        map_data_shared_memory=False,
+        timing=False,
+        timing_window=1000,
+        timing_callback=None,
+        run_config=None,
+        record_path=None,
+        pipeline_requests=False,
+        fast_reset=False,
+        recycle_episodes=None,
+        recycle_rss_mb=None,
+        recycle_step_latency=None,
     ):
         """
         Create a StarCraftC2Env environment.
@@ -192,13 +348,77 @@ class StarCraft2Env(MultiAgentEnv):
         debug: bool, optional
             Log messages about observations, state, actions and rewards for
             debugging purposes (default is False).
+        vectorized: bool, optional
+            Build the observations and available actions of all agents at
+            once with NumPy rather than calling the per-agent reference
+            implementation for each agent (default is True). Both produce
+            identical output.
+        map_cache_dir: str, optional
+            The directory in which the decoded pathing grid, terrain height
+            and playable area of each map are cached across processes
+            (default is None, in which case the SMAC_MAP_CACHE_DIR
+            environment variable is used if set). Map information is always
+            cached in memory within a process.
+        process_pool: StarCraft2ProcessPool, optional
+            A pool of pre-launched StarCraft II processes from which the
+            process of the environment is taken when launching and fully
+            restarting, instead of starting a new one (default is None). The
+            game version and window size of the pool are used.
+        map_data_shared_memory: bool, optional
+            Whether to share the contents of map files with the other
+            processes of the host through shared memory (default is False).
+            Map files are always read from disk once per process.
+        timing: bool, optional
+            Whether to measure the latency of the phases of step, reset and
+            restarts, reported by get_stats as the number of calls and the
+            50th, 95th and 99th latency percentiles of every phase (default
+            is False). Disabled timing has no overhead.
+        timing_window: int, optional
+            The number of most recent latencies of each phase from which
+            the percentiles are computed (default is 1000).
+        timing_callback: callable, optional
+            A function called as timing_callback(phase, seconds) after
+            every timed phase (default is None).
+        run_config: pysc2 RunConfig, optional
+            The run config used to start StarCraft II, e.g. a FakeRunConfig
+            to run without the game (default is None, in which case the run
+            config of game_version is used).
+        record_path: str, optional
+            A file into which the maps, game infos, observations and actions
+            of the environment are recorded, to be replayed without
+            StarCraft II by smac.env.starcraft2.recording.replay (default is
+            None, in which case nothing is recorded).
+        pipeline_requests: bool, optional
+            Whether to write the requests of a step to StarCraft II at once
+            and then read their responses, rather than waiting for the
+            response of each request before sending the next one (default
+            is False). This saves round trips to the game.
+        fast_reset: bool, optional
+            Whether to restart episodes by respawning the units of the
+            first episode of the map with debug commands, rather than
+            waiting for the trigger of the map to respawn them (default is
+            False). If the trigger respawns the units as well, fast reset
+            is disabled. An episode in which this is noticed terminates
+            with a fast_reset_failed entry in its info and is not counted
+            as a game. The mean duration and number of game loops of resets
+            are reported by get_stats either way.
+        recycle_episodes: int, optional
+            The number of episodes after which the StarCraft II process is
+            replaced by a new one before the next episode (default is None,
+            in which case processes are not recycled after a number of
+            episodes).
+        recycle_rss_mb: float, optional
+            The resident memory in megabytes of the StarCraft II process,
+            as reported by /proc, above which the process is replaced by a
+            new one before the next episode (default is None).
+        recycle_step_latency: float, optional
+            The mean latency in seconds of the requests of the last 100
+            steps above which the StarCraft II process is replaced by a new
+            one before the next episode (default is None). The number and
+            mean duration of restarts of every cause, including errors, are
+            reported by get_stats.
         """
         # Map arguments
-        self.map_name = map_name
-        map_params = get_map_params(self.map_name)
-        self.n_agents = map_params["n_agents"]
-        self.n_enemies = map_params["n_enemies"]
-        self.episode_limit = map_params["limit"]
         self._move_amount = move_amount
         self._step_mul = step_mul
         self.difficulty = difficulty
@@ -235,6 +455,21 @@ class StarCraft2Env(MultiAgentEnv):
         self.heuristic_ai = heuristic_ai
         self.heuristic_rest = heuristic_rest
         self.debug = debug
+        self.vectorized = vectorized
+        if map_cache_dir is None:
+            map_cache_dir = os.environ.get("SMAC_MAP_CACHE_DIR")
+        self._map_info_cache = MapInfoCache(map_cache_dir)
+        self._process_pool = process_pool
+        self._map_data_shared_memory = map_data_shared_memory
+        self._custom_run_config = run_config
+        self._pipeline_requests = pipeline_requests
+        self._fast_reset = fast_reset
+        self._supervisor = ProcessSupervisor(
+            recycle_episodes, recycle_rss_mb, recycle_step_latency
+        )
+        self._recorder = None
+        if record_path is not None:
+            self._recorder = StreamRecorder(record_path)
         self.window_size = (window_size_x, window_size_y)
         self.replay_dir = replay_dir
         self.replay_prefix = replay_prefix
@@ -242,6 +477,77 @@ class StarCraft2Env(MultiAgentEnv):
         # Actions
         self.n_actions_no_attack = 6
         self.n_actions_move = 4
+
+        self._init_map(map_name)
+        if self._recorder is not None:
+            self._recorder.write_map(map_name)
+
+        self._episode_count = 0
+        self._episode_steps = 0
+        self._total_steps = 0
+        self._obs = None
+        self.battles_won = 0
+        self.battles_game = 0
+        self.timeouts = 0
+        self.force_restarts = 0
+        self._step_cache = {}
+        self._step_cache_key = None
+        self._step_cache_hits = 0
+        self._step_cache_misses = 0
+        self._n_timed_resets = 0
+        self._reset_time = 0.0
+        self._reset_game_loops = 0
+        self.last_stats = None
+        self.reward = 0
+        self.renderer = None
+        self._run_config = None
+        self._sc2_proc = None
+        self._controller = None
+        self._restart_needed = False
+        self._step_executor = None
+        self._step_future = None
+
+        if pipeline_requests:
+            self._send_step_request = self._send_step_request_pipelined
+
+        self._timer = None
+        if timing:
+            self._timer = PhaseTimer(timing_window, timing_callback)
+            self._timer.wrap_methods(self, self._timed_methods)
+            if pipeline_requests:
+                self._send_step_request = self._timer.wrap(
+                    "sc2_requests", self._send_step_request
+                )
+            else:
+                self._send_step_request = self._send_step_request_timed
+        if recycle_step_latency is not None:
+            self._send_step_request = self._supervisor.track_latency(
+                self._send_step_request
+            )
+
+        # Try to avoid leaking SC2 processes on shutdown
+        atexit.register(lambda: self.close())
+
+    # The methods timed when timing is enabled, and their phases
+    _timed_methods = {
+        "step": "step",
+        "reset": "reset",
+        "_restart": "restart",
+        "full_restart": "full_restart",
+        "_build_action_request": "build_actions",
+        "update_units": "update_units",
+        "reward_battle": "reward",
+        "get_obs": "obs",
+        "get_state": "state",
+    }
+
+    def _init_map(self, map_name):
+        """Initialise the attributes that depend on the map."""
+        self.map_name = map_name
+        map_params = get_map_params(self.map_name)
+        self.n_agents = map_params["n_agents"]
+        self.n_enemies = map_params["n_enemies"]
+        self.episode_limit = map_params["limit"]
         self.n_actions = self.n_actions_no_attack + self.n_enemies
 
         # Map info
@@ -280,57 +586,65 @@ class StarCraft2Env(MultiAgentEnv):
 
         self.agents = {}
         self.enemies = {}
-        self._episode_count = 0
-        self._episode_steps = 0
-        self._total_steps = 0
-        self._obs = None
-        self.battles_won = 0
-        self.battles_game = 0
-        self.timeouts = 0
-        self.force_restarts = 0
-        self.last_stats = None
+        self._ally_tag_ids = {}
+        self._enemy_tag_ids = {}
         self.death_tracker_ally = np.zeros(self.n_agents)
         self.death_tracker_enemy = np.zeros(self.n_enemies)
-        self.previous_ally_units = None
-        self.previous_enemy_units = None
+        self.previous_ally_health = self.previous_ally_shield = None
+        self.previous_enemy_health = self.previous_enemy_shield = None
         self.last_action = np.zeros((self.n_agents, self.n_actions))
+        self.unit_arrays = UnitArrays(self.n_agents, self.n_enemies)
+        self._delta_x = self._delta_y = self._distances = None
+        self._sight_mask = self._shoot_mask = None
         self._min_unit_type = 0
         self.marine_id = self.marauder_id = self.medivac_id = 0
         self.hydralisk_id = self.zergling_id = self.baneling_id = 0
         self.stalker_id = self.colossus_id = self.zealot_id = 0
+        self._init_unit_type_tables()
+        self._unit_types_initialised = False
+        self._respawn_commands = None
+        self._respawned_tags = []
         self.max_distance_x = 0
         self.max_distance_y = 0
         self.map_x = 0
         self.map_y = 0
-        self.reward = 0
-        self.renderer = None
         self.terrain_height = None
         self.pathing_grid = None
-        self._run_config = None
-        self._sc2_proc = None
-        self._controller = None
-
-        # Try to avoid leaking SC2 processes on shutdown
-        atexit.register(lambda: self.close())
+        self._padded_pathing_grid = (None, 0, None)
 
     def _launch(self):
         """Launch the StarCraft II game."""
-        self._run_config = run_configs.get(version=self.game_version)
+        if self._process_pool is not None:
+            self._run_config = self._process_pool.run_config
+            self._sc2_proc = self._process_pool.acquire()
+        else:
+            self._run_config = self._custom_run_config or run_configs.get(
+                version=self.game_version
+            )
+            self._sc2_proc = self._run_config.start(
+                window_size=self.window_size, want_rgb=False
+            )
+        self._controller = self._sc2_proc.controller
+        self._supervisor.start_process()
+        if self._recorder is not None:
+            self._controller = RecordingController(
+                self._controller, self._recorder
+            )
+        self._start_game()
+
+    def _start_game(self):
+        """Create and join a game on the current map."""
         _map = maps.get(self.map_name)
 
         # Setting up the interface
         interface_options = sc_pb.InterfaceOptions(raw=True, score=False)
-        self._sc2_proc = self._run_config.start(
-            window_size=self.window_size, want_rgb=False
-        )
-        self._controller = self._sc2_proc.controller
 
         # Request to create the game
+        map_data = map_data_cache.get(
+            self._run_config, _map.path, self._map_data_shared_memory
+        )
         create = sc_pb.RequestCreateGame(
-            local_map=sc_pb.LocalMap(
-                map_path=_map.path,
-                map_data=self._run_config.map_data(_map.path),
-            ),
+            local_map=sc_pb.LocalMap(map_path=_map.path, map_data=map_data),
             realtime=False,
             random_seed=self._seed,
         )
@@ -347,81 +661,116 @@ class StarCraft2Env(MultiAgentEnv):
         )
         self._controller.join_game(join)
 
-        game_info = self._controller.game_info()
-        map_info = game_info.start_raw
-        map_play_area_min = map_info.playable_area.p0
-        map_play_area_max = map_info.playable_area.p1
-        self.max_distance_x = map_play_area_max.x - map_play_area_min.x
-        self.max_distance_y = map_play_area_max.y - map_play_area_min.y
-        self.map_x = map_info.map_size.x
-        self.map_y = map_info.map_size.y
-
-        if map_info.pathing_grid.bits_per_pixel == 1:
-            vals = np.array(list(map_info.pathing_grid.data)).reshape(
-                self.map_x, int(self.map_y / 8)
-            )
-            self.pathing_grid = np.transpose(
-                np.array(
-                    [
-                        [(b >> i) & 1 for b in row for i in range(7, -1, -1)]
-                        for row in vals
-                    ],
-                    dtype=bool,
-                )
-            )
-        else:
-            self.pathing_grid = np.invert(
-                np.flip(
-                    np.transpose(
-                        np.array(
-                            list(map_info.pathing_grid.data), dtype=bool
-                        ).reshape(self.map_x, self.map_y)
-                    ),
-                    axis=1,
-                )
-            )
+        self._init_map_info(map_data)
+        # The episode of a new game does not need to be restarted
+        self._restart_needed = False
 
-        self.terrain_height = (
-            np.flip(
-                np.transpose(
-                    np.array(list(map_info.terrain_height.data)).reshape(
-                        self.map_x, self.map_y
-                    )
-                ),
-                1,
-            )
-            / 255
+    def switch_map(self, map_name):
+        """Switch to another SMAC map, reusing the running StarCraft II
+        process. The environment must be reset afterwards.
+
+        All sizes that depend on the map, such as the number of agents and
+        the sizes of observations, states and actions, are updated, see
+        get_env_info.
+        """
+        if self._step_future is not None:
+            raise RuntimeError("A step started by step_async is pending.")
+        self._init_map(map_name)
+        if self._recorder is not None:
+            self._recorder.write_map(map_name)
+        self._clear_step_cache()
+        if self.renderer is not None:
+            self.renderer.close()
+            self.renderer = None
+        if self._controller is None:
+            return  # the game is created when launching StarCraft II
+
+        try:
+            self._controller.leave()
+            self._start_game()
+        except (protocol.ProtocolError, protocol.ConnectionError):
+            self.full_restart()
+
+    def _init_map_info(self, map_data):
+        """Initialise the map size, playable area, pathing grid and terrain
+        height of the current game, reusing cached values if available.
+        """
+        key = map_info_key(
+            self.map_name, self._run_config.version.game_version, map_data
         )
+        map_info = self._map_info_cache.get(key)
+        if map_info is None:
+            map_info = decode_map_info(self._controller.game_info())
+            self._map_info_cache.put(key, map_info)
+
+        self.max_distance_x = map_info["max_distance_x"]
+        self.max_distance_y = map_info["max_distance_y"]
+        self.map_x = map_info["map_x"]
+        self.map_y = map_info["map_y"]
+        self.pathing_grid = map_info["pathing_grid"]
+        self.terrain_height = map_info["terrain_height"]
 
     def reset(self):
         """Reset the environment. Required after each full episode.
         Returns initial observations and states.
         """
         self._episode_steps = 0
-        if self._episode_count == 0:
+        if self._recorder is not None:
+            self._recorder.write_reset()
+        reset_start = None
+        recycle_cause = self._get_recycle_cause()
+        if recycle_cause is not None:
+            self._recycle(recycle_cause)
+        if self._controller is None:
             # Launch StarCraft II
             self._launch()
-        else:
+        elif self._restart_needed:
+            reset_start = self._get_reset_start()
             self._restart()
 
+        self._reset_episode_state()
+
+        try:
+            self._obs = self._controller.observe()
+            self.init_units()
+        except (protocol.ProtocolError, protocol.ConnectionError):
+            self.full_restart()
+
+        return self._finish_reset(reset_start)
+
+    def _reset_episode_state(self):
+        """Reset the information kept during an episode."""
         # Information kept for counting the reward
         self.death_tracker_ally = np.zeros(self.n_agents)
         self.death_tracker_enemy = np.zeros(self.n_enemies)
-        self.previous_ally_units = None
-        self.previous_enemy_units = None
+        self.previous_ally_health = self.previous_ally_shield = None
+        self.previous_enemy_health = self.previous_enemy_shield = None
         self.win_counted = False
         self.defeat_counted = False
+        self._respawned_tags = []
 
         self.last_action = np.zeros((self.n_agents, self.n_actions))
 
         if self.heuristic_ai:
             self.heuristic_targets = [None] * self.n_agents
 
-        try:
-            self._obs = self._controller.observe()
-            self.init_units()
-        except (protocol.ProtocolError, protocol.ConnectionError):
-            self.full_restart()
+    def _finish_reset(self, reset_start=None):
+        """Complete a reset once the units have been initialised. Returns
+        initial observations and states. The duration of resets that
+        restarted an episode is recorded given their start, see
+        _get_reset_start.
+        """
+        self._restart_needed = True
+        self._clear_step_cache()
+        self._supervisor.start_episode()
+        if reset_start is not None:
+            start_time, start_game_loop = reset_start
+            game_loops = self._obs.observation.game_loop - start_game_loop
+            # Skip resets interrupted by a full restart
+            if game_loops >= 0:
+                self._n_timed_resets += 1
+                self._reset_time += time.perf_counter() - start_time
+                self._reset_game_loops += game_loops
 
         if self.debug:
             logging.debug(
@@ -432,26 +781,199 @@ class StarCraft2Env(MultiAgentEnv):
 
         return self.get_obs(), self.get_state()
 
+    def _get_reset_start(self):
+        """Returns the time and game loop at the start of a reset."""
+        return time.perf_counter(), self._obs.observation.game_loop
+
     def _restart(self):
         """Restart the environment by killing all units on the map.
         There is a trigger in the SC2Map file, which restarts the
         episode when there are no units left.
         """
+        debug_commands, game_loops = self._get_restart_commands()
         try:
-            self._kill_all_units()
-            self._controller.step(2)
+            self._controller.debug(debug_commands)
+            self._controller.step(game_loops)
         except (protocol.ProtocolError, protocol.ConnectionError):
             self.full_restart()
 
+    def _get_restart_commands(self):
+        """Returns the debug commands restarting the episode, and the number
+        of game loops to step after them. With fast reset, the units of the
+        first episode are respawned together with killing the current
+        ones, so that the map's trigger does not need to be waited for.
+        """
+        if self._respawn_commands is None:
+            return self._get_kill_all_units_command(), 2
+        return self._get_kill_all_units_command() + self._respawn_commands, 1
+
+    def _get_respawn_commands(self):
+        """Returns the debug commands creating the current units at their
+        positions.
+        """
+        return [
+            d_pb.DebugCommand(
+                create_unit=d_pb.DebugCreateUnit(
+                    unit_type=unit.unit_type,
+                    owner=unit.owner,
+                    pos=sc_common.Point2D(x=unit.pos.x, y=unit.pos.y),
+                    quantity=1,
+                )
+            )
+            for unit in itertools.chain(
+                self.agents.values(), self.enemies.values()
+            )
+        ]
+
+    def _fast_reset_failed(self):
+        """Whether the map's trigger spawned units in addition to those
+        respawned by fast reset, in which case fast reset is disabled and
+        the episode should be restarted again.
+        """
+        if self._respawn_commands is None or (
+            len(self.agents) <= self.n_agents
+            and len(self.enemies) <= self.n_enemies
+        ):
+            return False
+        self._disable_fast_reset()
+        return True
+
+    def _disable_fast_reset(self):
+        logging.warning("Too many units after a fast reset, disabling it.")
+        self._fast_reset = False
+        self._respawn_commands = None
+
     def full_restart(self):
         """Full restart. Closes the SC2 process and launches a new one."""
+        start_time = time.perf_counter()
         self._sc2_proc.close()
         self._launch()
         self.force_restarts += 1
+        self._clear_step_cache()
+        self._supervisor.record_restart(
+            "error", time.perf_counter() - start_time
+        )
+
+    def _get_recycle_cause(self):
+        """Returns why the SC2 process should be replaced before the next
+        episode, or None if it should not.
+        """
+        if self._controller is None or not self._restart_needed:
+            return None
+        return self._supervisor.get_recycle_cause(
+            getattr(self._sc2_proc, "pid", None)
+        )
+
+    def _recycle(self, cause):
+        """Replace the SC2 process by a new one between episodes."""
+        logging.info("Recycling the StarCraft II process: {}".format(cause))
+        start_time = time.perf_counter()
+        self._sc2_proc.close()
+        self._launch()
+        self._clear_step_cache()
+        self._supervisor.record_restart(
+            cause, time.perf_counter() - start_time
+        )
 
     def step(self, actions):
         """A single environment step. Returns reward, terminated, info."""
+        req_actions = self._build_action_request(actions)
+        try:
+            self._obs = self._send_step_request(req_actions)
+        except (protocol.ProtocolError, protocol.ConnectionError):
+            self.full_restart()
+            return 0, True, {}
+        return self._process_step()
+
+    def step_async(self, actions):
+        """Start an environment step without waiting for StarCraft II.
+
+        The actions are applied and the game is stepped and observed on a
+        background thread, while the calling thread is free to do other
+        work. The step must be completed by calling step_wait, and no other
+        method of the environment should be called in between.
+        """
+        if self._step_future is not None:
+            raise RuntimeError("A step started by step_async is pending.")
+        req_actions = self._build_action_request(actions)
+        if self._step_executor is None:
+            self._step_executor = ThreadPoolExecutor(max_workers=1)
+        self._step_future = self._step_executor.submit(
+            self._send_step_request, req_actions
+        )
+
+    def step_wait(self):
+        """Wait for the step started by step_async to complete.
+        Returns reward, terminated, info.
+        """
+        if self._step_future is None:
+            raise RuntimeError("No step has been started by step_async.")
+        future, self._step_future = self._step_future, None
+        try:
+            self._obs = future.result()
+        except (protocol.ProtocolError, protocol.ConnectionError):
+            self.full_restart()
+            return 0, True, {}
+        return self._process_step()
+
+    def step_repeat(self, actions, k, step_mul=None):
+        """Repeat the actions of the agents for k steps, stopping early if
+        the episode terminates. Returns the sum of the rewards, whether the
+        episode terminated and the info of the last step, whose
+        "repeated_steps" entry is the number of steps made.
+
+        Agents whose action becomes unavailable stop, or do nothing once
+        dead. No observations or states are computed in between, so that
+        get_obs and get_state are only evaluated for the last step.
+
+        Parameters
+        ----------
+        actions : list
+            The actions of the agents.
+        k : int
+            The number of steps.
+        step_mul : int, optional
+            The number of game steps per agent step for these steps (default
+            is None, in which case the step_mul of the environment is used).
+        """
+        if k < 1:
+            raise ValueError("k must be at least 1, got {}.".format(k))
+        actions = [int(a) for a in actions]
+        env_step_mul = self._step_mul
+        if step_mul is not None:
+            self._step_mul = step_mul
+        total_reward = 0
+        try:
+            for n_steps in range(1, k + 1):
+                reward, terminated, info = self.step(list(actions))
+                total_reward += reward
+                if terminated or n_steps == k:
+                    break
+                self._update_repeated_actions(actions)
+        finally:
+            self._step_mul = env_step_mul
+        info["repeated_steps"] = n_steps
+        return total_reward, terminated, info
+
+    def _update_repeated_actions(self, actions):
+        """Replace the repeated actions of step_repeat that have become
+        unavailable, in place.
+        """
+        if self.vectorized:
+            avail_actions = self.get_avail_actions_array()
+        else:
+            avail_actions = np.array(self.get_avail_actions())
+        for agent_id, action in enumerate(actions):
+            agent_avail_actions = avail_actions[agent_id]
+            if not agent_avail_actions[action]:
+                # Stop if alive, no-op if dead
+                actions[agent_id] = int(agent_avail_actions[1])
+
+    def _build_action_request(self, actions):
+        """Returns the action request for the given actions of the agents."""
         actions_int = [int(a) for a in actions]
+        if self._recorder is not None:
+            self._recorder.write_agent_actions(actions_int)
 
         self.last_action = np.eye(self.n_actions)[np.array(actions_int)]
 
@@ -471,20 +993,131 @@ class StarCraft2Env(MultiAgentEnv):
             if sc_action:
                 sc_actions.append(sc_action)
 
-        # Send action request
-        req_actions = sc_pb.RequestAction(actions=sc_actions)
-        try:
-            self._controller.actions(req_actions)
-            # Make step in SC2, i.e. apply actions
-            self._controller.step(self._step_mul)
-            # Observe here so that we know if the episode is over.
-            self._obs = self._controller.observe()
-        except (protocol.ProtocolError, protocol.ConnectionError):
-            self.full_restart()
-            return 0, True, {}
+        return sc_pb.RequestAction(actions=sc_actions)
+
+    def _send_step_request(self, req_actions):
+        """Send the action request, step the game and return the resulting
+        observation.
+        """
+        self._controller.actions(req_actions)
+        # Make step in SC2, i.e. apply actions
+        self._controller.step(self._step_mul)
+        # Observe here so that we know if the episode is over.
+        return self._controller.observe()
+
+    def _send_step_request_pipelined(self, req_actions):
+        """_send_step_request writing the three requests to SC2 at once."""
+        controller_class = remote_controller.RemoteController
+        if not isinstance(self._controller, controller_class):
+            return StarCraft2Env._send_step_request(self, req_actions)
+        _, _, obs = self._send_requests_pipelined(
+            [
+                ("action", req_actions),
+                ("step", sc_pb.RequestStep(count=self._step_mul)),
+                ("observation", sc_pb.RequestObservation()),
+            ]
+        )
+        return self._replace_stub_observation(obs)
 
+    def _step_and_observe(self, count):
+        """Step the game and return the resulting observation."""
+        if self._pipeline_requests and isinstance(
+            self._controller, remote_controller.RemoteController
+        ):
+            _, obs = self._send_requests_pipelined(
+                [
+                    ("step", sc_pb.RequestStep(count=count)),
+                    ("observation", sc_pb.RequestObservation()),
+                ]
+            )
+            return self._replace_stub_observation(obs)
+        self._controller.step(count)
+        return self._controller.observe()
+
+    def _send_requests_pipelined(self, requests):
+        """Write requests, given as (name, request) pairs, to the SC2 process
+        of the controller back-to-back, then read and return their
+        responses. Errors are raised as by the methods of the controller.
+        """
+        client = self._controller._client
+        if client.status != protocol.Status.in_game:
+            raise protocol.ProtocolError(
+                "Pipelined requests sent while in state: {}".format(
+                    client.status
+                )
+            )
+        reqs = []
+        for name, request in requests:
+            req = sc_pb.Request(**{name: request})
+            req.id = next(client._count)
+            client.write(req)
+            reqs.append((name, req))
+
+        responses = []
+        error = None
+        for name, req in reqs:
+            # All responses are read, even after an error, so that later
+            # requests are not answered by responses to these
+            try:
+                res = client.read()
+            except protocol.ProtocolError as e:
+                # Suppressed like the controller does for actions and steps
+                if error is None and not (
+                    name != "observation"
+                    and "Game has already ended" in str(e)
+                ):
+                    error = e
+                responses.append(None)
+                continue
+            if res.HasField("id") and res.id != req.id:
+                raise protocol.ConnectionError(
+                    "Error during {}: Got a response with a different "
+                    "id".format(name)
+                )
+            responses.append(getattr(res, name))
+        if error is not None:
+            raise error
+        return responses
+
+    def _replace_stub_observation(self, obs):
+        """Replace the stub observation sent by SC2 at the end of a game
+        with the previous observation, as the controller's observe does.
+        """
+        controller = self._controller
+        if obs.observation.game_loop != 2**32 - 1:
+            controller._last_obs = obs
+            return obs
+        if not obs.player_result or controller._last_obs is None:
+            raise protocol.ProtocolError("Unexpected stub observation.")
+        new_obs = sc_pb.ResponseObservation()
+        new_obs.CopyFrom(controller._last_obs)
+        del new_obs.actions[:]
+        new_obs.actions.extend(obs.actions)
+        new_obs.player_result.extend(obs.player_result)
+        controller._last_obs = None
+        return new_obs
+
+    def _send_step_request_timed(self, req_actions):
+        """_send_step_request timing each request to SC2."""
+        start = time.perf_counter()
+        self._controller.actions(req_actions)
+        actions_end = time.perf_counter()
+        self._controller.step(self._step_mul)
+        step_end = time.perf_counter()
+        obs = self._controller.observe()
+        observe_end = time.perf_counter()
+        self._timer.record("sc2_actions", actions_end - start)
+        self._timer.record("sc2_step", step_end - actions_end)
+        self._timer.record("sc2_observe", observe_end - step_end)
+        return obs
+
+    def _process_step(self):
+        """Update the environment from the observation of a step. Returns
+        reward, terminated, info.
+        """
         self._total_steps += 1
         self._episode_steps += 1
+        self._clear_step_cache()
 
         # Update units
         game_end_code = self.update_units()
@@ -494,18 +1127,15 @@ class StarCraft2Env(MultiAgentEnv):
         info = {"battle_won": False}
 
         # count units that are still alive
-        dead_allies, dead_enemies = 0, 0
-        for _al_id, al_unit in self.agents.items():
-            if al_unit.health == 0:
-                dead_allies += 1
-        for _e_id, e_unit in self.enemies.items():
-            if e_unit.health == 0:
-                dead_enemies += 1
-
-        info["dead_allies"] = dead_allies
-        info["dead_enemies"] = dead_enemies
-
-        if game_end_code is not None:
+        units = self.unit_arrays
+        info["dead_allies"] = int(np.sum(units.health[units.ally] == 0))
+        info["dead_enemies"] = int(np.sum(units.health[units.enemy] == 0))
+
+        if self._respawned_tags:
+            # The episode cannot go on, but is not counted as a game
+            terminated = True
+            info["fast_reset_failed"] = True
+        elif game_end_code is not None:
             # Battle is over
             terminated = True
             self.battles_game += 1
@@ -674,12 +1304,7 @@ class StarCraft2Env(MultiAgentEnv):
                         al_unit.health != 0
                         and al_unit.health != al_unit.health_max
                     ):
-                        dist = self.distance(
-                            unit.pos.x,
-                            unit.pos.y,
-                            al_unit.pos.x,
-                            al_unit.pos.y,
-                        )
+                        dist = self._distances[a_id, al_id]
                         if dist < min_dist:
                             min_dist = dist
                             min_id = al_id
@@ -700,9 +1325,7 @@ class StarCraft2Env(MultiAgentEnv):
                     ):
                         continue
                     if e_unit.health > 0:
-                        dist = self.distance(
-                            unit.pos.x, unit.pos.y, e_unit.pos.x, e_unit.pos.y
-                        )
+                        dist = self._distances[a_id, self.n_agents + e_id]
                         if dist < min_dist:
                             min_dist = dist
                             min_id = e_id
@@ -781,45 +1404,41 @@ class StarCraft2Env(MultiAgentEnv):
         if self.reward_sparse:
             return 0
 
-        reward = 0
-        delta_deaths = 0
-        delta_ally = 0
-        delta_enemy = 0
-
         neg_scale = self.reward_negative_scale
-
-        # update deaths
-        for al_id, al_unit in self.agents.items():
-            if not self.death_tracker_ally[al_id]:
-                # did not die so far
-                prev_health = (
-                    self.previous_ally_units[al_id].health
-                    + self.previous_ally_units[al_id].shield
-                )
-                if al_unit.health == 0:
-                    # just died
-                    self.death_tracker_ally[al_id] = 1
-                    if not self.reward_only_positive:
-                        delta_deaths -= self.reward_death_value * neg_scale
-                    delta_ally += prev_health * neg_scale
-                else:
-                    # still alive
-                    delta_ally += neg_scale * (
-                        prev_health - al_unit.health - al_unit.shield
-                    )
-
-        for e_id, e_unit in self.enemies.items():
-            if not self.death_tracker_enemy[e_id]:
-                prev_health = (
-                    self.previous_enemy_units[e_id].health
-                    + self.previous_enemy_units[e_id].shield
-                )
-                if e_unit.health == 0:
-                    self.death_tracker_enemy[e_id] = 1
-                    delta_deaths += self.reward_death_value
-                    delta_enemy += prev_health
-                else:
-                    delta_enemy += prev_health - e_unit.health - e_unit.shield
+        units = self.unit_arrays
+        ally_health = units.health[units.ally]
+        ally_shield = units.shield[units.ally]
+        enemy_health = units.health[units.enemy]
+        enemy_shield = units.shield[units.enemy]
+
+        # update deaths of the units that did not die so far
+        prev_health = self.previous_ally_health + self.previous_ally_shield
+        tracked = self.death_tracker_ally == 0
+        ally_died = tracked & (ally_health == 0)
+        self.death_tracker_ally[ally_died] = 1
+        ally_damage = np.where(
+            ally_died,
+            prev_health * neg_scale,
+            neg_scale * (prev_health - ally_health - ally_shield),
+        )[tracked]
+
+        prev_health = self.previous_enemy_health + self.previous_enemy_shield
+        tracked = self.death_tracker_enemy == 0
+        enemy_died = tracked & (enemy_health == 0)
+        self.death_tracker_enemy[enemy_died] = 1
+        enemy_damage = np.where(
+            enemy_died, prev_health, prev_health - enemy_health - enemy_shield
+        )[tracked]
+
+        # Accumulate in unit id order, as a loop over the units would
+        deaths = [self.reward_death_value] * int(enemy_died.sum())
+        if not self.reward_only_positive:
+            deaths = [-self.reward_death_value * neg_scale] * int(
+                ally_died.sum()
+            ) + deaths
+        delta_deaths = sum(deaths)
+        delta_ally = sum(ally_damage.tolist())
+        delta_enemy = sum(enemy_damage.tolist())
 
         if self.reward_only_positive:
             reward = abs(delta_enemy + delta_deaths)  # shield regeneration
@@ -847,18 +1466,9 @@ class StarCraft2Env(MultiAgentEnv):
 
     def unit_max_cooldown(self, unit):
         """Returns the maximal cooldown for a unit."""
-        switcher = {
-            self.marine_id: 15,
-            self.marauder_id: 25,
-            self.medivac_id: 200,  # max energy
-            self.stalker_id: 35,
-            self.zealot_id: 22,
-            self.colossus_id: 24,
-            self.hydralisk_id: 10,
-            self.zergling_id: 11,
-            self.baneling_id: 1,
-        }
-        return switcher.get(unit.unit_type, 15)
+        return int(
+            self._lookup_unit_types(self._max_cooldown_table, unit.unit_type)
+        )
 
     def save_replay(self):
         """Save a replay."""
@@ -873,12 +1483,11 @@ class StarCraft2Env(MultiAgentEnv):
 
     def unit_max_shield(self, unit):
         """Returns maximal shield for a given unit."""
-        if unit.unit_type == 74 or unit.unit_type == self.stalker_id:
-            return 80  # Protoss's Stalker
-        if unit.unit_type == 73 or unit.unit_type == self.zealot_id:
-            return 50  # Protoss's Zaelot
-        if unit.unit_type == 4 or unit.unit_type == self.colossus_id:
-            return 150  # Protoss's Colossus
+        max_shield = self._lookup_unit_types(
+            self._max_shield_table, unit.unit_type
+        )
+        if not np.isnan(max_shield):
+            return int(max_shield)
 
     def can_move(self, unit, direction):
         """Whether a unit can move in a given direction."""
@@ -943,6 +1552,7 @@ class StarCraft2Env(MultiAgentEnv):
         ]
         return vals
 
+    @step_cached
     def get_obs_agent(self, agent_id):
         """Returns observation for agent_id. The observation is composed of:
 
@@ -968,9 +1578,15 @@ class StarCraft2Env(MultiAgentEnv):
         unit_type is not included if there is only one type of unit in the
         map etc.).
 
+        The observation is computed once per step and every call returns a
+        new copy of it, which the caller may modify.
+
         NOTE: Agents should have access only to their local observations
         during decentralised execution.
         """
+        if self.vectorized:
+            return self._get_obs_batch()[agent_id]
+
         unit = self.get_unit_by_id(agent_id)
 
         move_feats_dim = self.get_obs_move_feats_size()
@@ -1008,11 +1624,11 @@ class StarCraft2Env(MultiAgentEnv):
             for e_id, e_unit in self.enemies.items():
                 e_x = e_unit.pos.x
                 e_y = e_unit.pos.y
-                dist = self.distance(x, y, e_x, e_y)
+                dist = self._distances[agent_id, self.n_agents + e_id]
 
-                if (
-                    dist < sight_range and e_unit.health > 0
-                ):  # visible and alive
+                if self._sight_mask[
+                    agent_id, self.n_agents + e_id
+                ]:  # visible and alive
                     # Sight range > shoot range
                     enemy_feats[e_id, 0] = avail_actions[
                         self.n_actions_no_attack + e_id
@@ -1051,11 +1667,9 @@ class StarCraft2Env(MultiAgentEnv):
                 al_unit = self.get_unit_by_id(al_id)
                 al_x = al_unit.pos.x
                 al_y = al_unit.pos.y
-                dist = self.distance(x, y, al_x, al_y)
+                dist = self._distances[agent_id, al_id]
 
-                if (
-                    dist < sight_range and al_unit.health > 0
-                ):  # visible and alive
+                if self._sight_mask[agent_id, al_id]:  # visible and alive
                     ally_feats[i, 0] = 1  # visible
                     ally_feats[i, 1] = dist / sight_range  # distance
                     ally_feats[i, 2] = (al_x - x) / sight_range  # relative X
@@ -1124,35 +1738,266 @@ class StarCraft2Env(MultiAgentEnv):
 
         return agent_obs
 
-    def get_obs(self):
+    def get_obs(self, out=None):
         """Returns all agent observations in a list.
+
+        If ``out`` is given, the observations are instead written into this
+        float32 array of shape (n_agents, obs_size), which is returned.
+        Otherwise the returned arrays are new copies, which the caller may
+        modify.
+
+        obs_size is ``get_obs_size() + 1`` if ``obs_timestep_number`` is set,
+        as the timestep is then appended to every observation on top of the
+        entry counted by ``get_obs_size``.
+
         NOTE: Agents should have access only to their local observations
         during decentralised execution.
         """
+        if self.vectorized:
+            if out is not None:
+                return self._get_obs_batch(out=out)
+            return list(self._get_obs_batch().copy())
         agents_obs = [self.get_obs_agent(i) for i in range(self.n_agents)]
+        if out is not None:
+            for agent_id, agent_obs in enumerate(agents_obs):
+                out[agent_id] = agent_obs
+            return out
         return agents_obs
 
-    def get_state(self):
+    def _get_obs_row_size(self):
+        """Returns the length of the observation arrays. The timestep is
+        counted in get_obs_own_feats_size and appended once more by
+        get_obs_agent, so it adds one entry to get_obs_size.
+        """
+        return self.get_obs_size() + int(self.obs_timestep_number)
+
+    @step_cached(shared=True)
+    def _get_obs_batch(self, out=None):
+        """Returns the observations of all agents as a single array with one
+        row per agent, optionally writing them into ``out``. This is a
+        vectorised equivalent of calling ``get_obs_agent`` for every agent
+        and produces identical values.
+        """
+        al = self._get_unit_arrays(ally=True)
+        en = self._get_unit_arrays(ally=False)
+        n_enemies, nf_en = self.get_obs_enemy_feats_size()
+        n_allies, nf_al = self.get_obs_ally_feats_size()
+
+        alive = al["health"] > 0
+        ally_slice = slice(0, self.n_agents)
+        enemy_slice = slice(self.n_agents, self.n_agents + self.n_enemies)
+        sight_range = np.array(
+            [self.unit_sight_range(i) for i in range(self.n_agents)]
+        )[:, None]
+        avail_actions = self.get_avail_actions_array()
+
+        # Movement features
+        move_feats = np.zeros(
+            (self.n_agents, self.get_obs_move_feats_size()), dtype=np.float32
+        )
+        move_feats[:, : self.n_actions_move] = avail_actions[
+            :, 2 : 2 + self.n_actions_move  # noqa
+        ]
+        ind = self.n_actions_move
+        if self.obs_pathing_grid:
+            move_feats[
+                :, ind : ind + self.n_obs_pathing  # noqa
+            ] = self._get_surrounding_vals(self.pathing_grid, al, False)
+            ind += self.n_obs_pathing
+        if self.obs_terrain_height:
+            move_feats[:, ind:] = self._get_surrounding_vals(
+                self.terrain_height, al, True
+            )
+        move_feats[~alive] = 0
+
+        # Enemy features
+        e_dx = self._delta_x[:, enemy_slice]
+        e_dy = self._delta_y[:, enemy_slice]
+        e_dist = self._distances[:, enemy_slice]
+        e_visible = self._sight_mask[:, enemy_slice]
+
+        enemy_feats = np.zeros(
+            (self.n_agents, n_enemies, nf_en), dtype=np.float32
+        )
+        attack_ind = self.n_actions_no_attack
+        enemy_feats[:, :, 0] = avail_actions[
+            :, attack_ind : attack_ind + n_enemies  # noqa
+        ]
+        enemy_feats[:, :, 1] = e_dist / sight_range
+        enemy_feats[:, :, 2] = e_dx / sight_range
+        enemy_feats[:, :, 3] = e_dy / sight_range
+        ind = 4
+        if self.obs_all_health:
+            enemy_feats[:, :, ind] = en["health"] / en["health_max"]
+            ind += 1
+            if self.shield_bits_enemy > 0:
+                enemy_feats[:, :, ind] = en["shield"] / en["max_shield"]
+                ind += 1
+        if self.unit_type_bits > 0:
+            enemy_feats[:, :, ind : ind + self.unit_type_bits] = en[  # noqa
+                "type_one_hot"
+            ]
+        enemy_feats[~e_visible] = 0
+
+        # Ally features, computed for all pairs before dropping self-pairs
+        a_dx = self._delta_x[:, ally_slice]
+        a_dy = self._delta_y[:, ally_slice]
+        a_dist = self._distances[:, ally_slice]
+        a_visible = self._sight_mask[:, ally_slice]
+
+        ally_feats = np.zeros(
+            (self.n_agents, self.n_agents, nf_al), dtype=np.float32
+        )
+        ally_feats[:, :, 0] = 1
+        ally_feats[:, :, 1] = a_dist / sight_range
+        ally_feats[:, :, 2] = a_dx / sight_range
+        ally_feats[:, :, 3] = a_dy / sight_range
+        ind = 4
+        if self.obs_all_health:
+            ally_feats[:, :, ind] = al["health"] / al["health_max"]
+            ind += 1
+            if self.shield_bits_ally > 0:
+                ally_feats[:, :, ind] = al["shield"] / al["max_shield"]
+                ind += 1
+        if self.unit_type_bits > 0:
+            ally_feats[:, :, ind : ind + self.unit_type_bits] = al[  # noqa
+                "type_one_hot"
+            ]
+            ind += self.unit_type_bits
+        if self.obs_last_action:
+            ally_feats[:, :, ind:] = self.last_action
+        ally_feats[~a_visible] = 0
+        not_self = ~np.eye(self.n_agents, dtype=bool)
+        ally_feats = ally_feats[not_self].reshape(
+            self.n_agents, n_allies, nf_al
+        )
+
+        # Own features
+        own_feats = np.zeros(
+            (self.n_agents, self.get_obs_own_feats_size()), dtype=np.float32
+        )
+        ind = 0
+        if self.obs_own_health:
+            own_feats[:, ind] = al["health"] / al["health_max"]
+            ind += 1
+            if self.shield_bits_ally > 0:
+                own_feats[:, ind] = al["shield"] / al["max_shield"]
+                ind += 1
+        if self.unit_type_bits > 0:
+            own_feats[:, ind : ind + self.unit_type_bits] = al[  # noqa
+                "type_one_hot"
+            ]
+        own_feats[~alive] = 0
+
+        if out is None:
+            # Matches the float64 result of np.append in get_obs_agent
+            dtype = np.float64 if self.obs_timestep_number else np.float32
+            out = np.empty(
+                (self.n_agents, self._get_obs_row_size()), dtype=dtype
+            )
+
+        ind = 0
+        for feats in (move_feats, enemy_feats, ally_feats, own_feats):
+            feats = feats.reshape(self.n_agents, -1)
+            out[:, ind : ind + feats.shape[1]] = feats  # noqa
+            ind += feats.shape[1]
+
+        if self.obs_timestep_number:
+            out[:, ind] = self._episode_steps / self.episode_limit
+
+        return out
+
+    def _get_unit_arrays(self, ally):
+        """Returns the features of the allies or enemies used in
+        observations as a dictionary of arrays indexed by unit id.
+        """
+        store = self.unit_arrays
+        group = store.ally if ally else store.enemy
+        arrays = {
+            field: getattr(store, field)[group]
+            for field in ("x", "y", "health", "health_max", "shield")
+        }
+        unit_types = store.unit_type[group]
+        shield_bits = self.shield_bits_ally if ally else self.shield_bits_enemy
+        if shield_bits > 0:
+            arrays["max_shield"] = self._lookup_unit_types(
+                self._max_shield_table, unit_types
+            )
+        if self.unit_type_bits > 0:
+            if ally:
+                one_hot = self._ally_type_one_hot_table
+            else:
+                one_hot = self._enemy_type_one_hot_table
+            arrays["type_one_hot"] = self._lookup_unit_types(
+                one_hot, unit_types
+            )
+        return arrays
+
+    def _get_surrounding_vals(self, grid, unit_arrays, include_self):
+        """Returns the values of the grid at the surrounding points of each
+        unit, with 1 for points outside of the map bounds.
+        """
+        ma = self._move_amount
+        offsets = np.array(
+            [
+                (0, 2 * ma),
+                (0, -2 * ma),
+                (2 * ma, 0),
+                (-2 * ma, 0),
+                (ma, ma),
+                (-ma, -ma),
+                (ma, -ma),
+                (-ma, ma),
+            ]
+            + ([(0, 0)] if include_self else [])
+        )
+        x = unit_arrays["x"].astype(int)[:, None] + offsets[:, 0]
+        y = unit_arrays["y"].astype(int)[:, None] + offsets[:, 1]
+        in_bounds = (x >= 0) & (x < self.map_x) & (y >= 0) & (y < self.map_y)
+        vals = grid[
+            np.clip(x, 0, grid.shape[0] - 1), np.clip(y, 0, grid.shape[1] - 1)
+        ]
+        return np.where(in_bounds, vals, 1)
+
+    @step_cached
+    def get_state(self, out=None):
         """Returns the global state.
+
+        If ``out`` is given, the state is instead written into this float32
+        array of shape (state_size,), which is returned. Otherwise a new copy
+        of the state, computed once per step, is returned.
+
+        state_size is ``get_state_size()``, except with both
+        ``obs_instead_of_state`` and ``obs_timestep_number`` set, where the
+        state holds the observations of ``get_obs`` and state_size is
+        ``n_agents * (get_obs_size() + 1)``.
+
         NOTE: This functon should not be used during decentralised execution.
         """
         if self.obs_instead_of_state:
-            obs_concat = np.concatenate(self.get_obs(), axis=0).astype(
-                np.float32
-            )
-            return obs_concat
+            if out is None:
+                out = np.empty(
+                    self.n_agents * self._get_obs_row_size(), dtype=np.float32
+                )
+            self.get_obs(out=out.reshape(self.n_agents, -1))
+            return out
 
         state_dict = self.get_state_dict()
 
-        state = np.append(
-            state_dict["allies"].flatten(), state_dict["enemies"].flatten()
-        )
+        parts = [state_dict["allies"], state_dict["enemies"]]
         if "last_action" in state_dict:
-            state = np.append(state, state_dict["last_action"].flatten())
+            parts.append(state_dict["last_action"])
         if "timestep" in state_dict:
-            state = np.append(state, state_dict["timestep"])
+            parts.append(state_dict["timestep"])
 
-        state = state.astype(dtype=np.float32)
+        state = out
+        if state is None:
+            state = np.empty(self.get_state_size(), dtype=np.float32)
+        ind = 0
+        for part in parts:
+            part = np.ravel(part)
+            state[ind : ind + part.size] = part  # noqa
+            ind += part.size
 
         if self.debug:
             logging.debug("STATE".center(60, "-"))
@@ -1190,63 +2035,54 @@ class StarCraft2Env(MultiAgentEnv):
         center_x = self.map_x / 2
         center_y = self.map_y / 2
 
-        for al_id, al_unit in self.agents.items():
-            if al_unit.health > 0:
-                x = al_unit.pos.x
-                y = al_unit.pos.y
-                max_cd = self.unit_max_cooldown(al_unit)
-
-                ally_state[al_id, 0] = (
-                    al_unit.health / al_unit.health_max
-                )  # health
-                if (
-                    self.map_type == "MMM"
-                    and al_unit.unit_type == self.medivac_id
-                ):
-                    ally_state[al_id, 1] = al_unit.energy / max_cd  # energy
-                else:
-                    ally_state[al_id, 1] = (
-                        al_unit.weapon_cooldown / max_cd
-                    )  # cooldown
-                ally_state[al_id, 2] = (
-                    x - center_x
-                ) / self.max_distance_x  # relative X
-                ally_state[al_id, 3] = (
-                    y - center_y
-                ) / self.max_distance_y  # relative Y
+        units = self.unit_arrays
+        # Only alive units have features, indexed by unit id and by their
+        # position in the unit arrays
+        al_ids = np.flatnonzero(units.alive[units.ally])
+        e_ids = np.flatnonzero(units.alive[units.enemy])
+        al = al_ids
+        en = e_ids + self.n_agents
 
-                if self.shield_bits_ally > 0:
-                    max_shield = self.unit_max_shield(al_unit)
-                    ally_state[al_id, 4] = (
-                        al_unit.shield / max_shield
-                    )  # shield
-
-                if self.unit_type_bits > 0:
-                    type_id = self.get_unit_type_id(al_unit, True)
-                    ally_state[al_id, type_id - self.unit_type_bits] = 1
-
-        for e_id, e_unit in self.enemies.items():
-            if e_unit.health > 0:
-                x = e_unit.pos.x
-                y = e_unit.pos.y
-
-                enemy_state[e_id, 0] = (
-                    e_unit.health / e_unit.health_max
-                )  # health
-                enemy_state[e_id, 1] = (
-                    x - center_x
-                ) / self.max_distance_x  # relative X
-                enemy_state[e_id, 2] = (
-                    y - center_y
-                ) / self.max_distance_y  # relative Y
-
-                if self.shield_bits_enemy > 0:
-                    max_shield = self.unit_max_shield(e_unit)
-                    enemy_state[e_id, 3] = e_unit.shield / max_shield  # shield
-
-                if self.unit_type_bits > 0:
-                    type_id = self.get_unit_type_id(e_unit, False)
-                    enemy_state[e_id, type_id - self.unit_type_bits] = 1
+        max_cd = self._lookup_unit_types(
+            self._max_cooldown_table, units.unit_type[al]
+        )
+        ally_state[al_ids, 0] = units.health[al] / units.health_max[al]
+        if self.map_type == "MMM":
+            is_medivac = units.unit_type[al] == self.medivac_id
+            ally_state[al_ids, 1] = (
+                np.where(
+                    is_medivac, units.energy[al], units.weapon_cooldown[al]
+                )
+                / max_cd
+            )  # energy or cooldown
+        else:
+            ally_state[al_ids, 1] = units.weapon_cooldown[al] / max_cd
+        ally_state[al_ids, 2] = (units.x[al] - center_x) / self.max_distance_x
+        ally_state[al_ids, 3] = (units.y[al] - center_y) / self.max_distance_y
+
+        enemy_state[e_ids, 0] = units.health[en] / units.health_max[en]
+        enemy_state[e_ids, 1] = (units.x[en] - center_x) / self.max_distance_x
+        enemy_state[e_ids, 2] = (units.y[en] - center_y) / self.max_distance_y
+
+        if self.shield_bits_ally > 0:
+            max_shield = self._lookup_unit_types(
+                self._max_shield_table, units.unit_type[al]
+            )
+            ally_state[al_ids, 4] = units.shield[al] / max_shield
+        if self.shield_bits_enemy > 0:
+            max_shield = self._lookup_unit_types(
+                self._max_shield_table, units.unit_type[en]
+            )
+            enemy_state[e_ids, 3] = units.shield[en] / max_shield
+
+        if self.unit_type_bits > 0:
+            type_bits = slice(-self.unit_type_bits, None)
+            ally_state[al_ids, type_bits] = self._lookup_unit_types(
+                self._ally_type_one_hot_table, units.unit_type[al]
+            )
+            enemy_state[e_ids, type_bits] = self._lookup_unit_types(
+                self._enemy_type_one_hot_table, units.unit_type[en]
+            )
 
         state = {"allies": ally_state, "enemies": enemy_state}
 
@@ -1344,85 +2180,25 @@ class StarCraft2Env(MultiAgentEnv):
         (n_agents, n_agents + n_enemies) indicating which units
         are visible to each agent.
         """
-        arr = np.zeros(
-            (self.n_agents, self.n_agents + self.n_enemies),
-            dtype=bool,
-        )
-
-        for agent_id in range(self.n_agents):
-            current_agent = self.get_unit_by_id(agent_id)
-            if current_agent.health > 0:  # it agent not dead
-                x = current_agent.pos.x
-                y = current_agent.pos.y
-                sight_range = self.unit_sight_range(agent_id)
-
-                # Enemies
-                for e_id, e_unit in self.enemies.items():
-                    e_x = e_unit.pos.x
-                    e_y = e_unit.pos.y
-                    dist = self.distance(x, y, e_x, e_y)
-
-                    if dist < sight_range and e_unit.health > 0:
-                        # visible and alive
-                        arr[agent_id, self.n_agents + e_id] = 1
-
-                # The matrix for allies is filled symmetrically
-                al_ids = [
-                    al_id for al_id in range(self.n_agents) if al_id > agent_id
-                ]
-                for _, al_id in enumerate(al_ids):
-                    al_unit = self.get_unit_by_id(al_id)
-                    al_x = al_unit.pos.x
-                    al_y = al_unit.pos.y
-                    dist = self.distance(x, y, al_x, al_y)
-
-                    if dist < sight_range and al_unit.health > 0:
-                        # visible and alive
-                        arr[agent_id, al_id] = arr[al_id, agent_id] = 1
-
-        return arr
+        return self._sight_mask.copy()
 
     def get_unit_type_id(self, unit, ally):
         """Returns the ID of unit type in the given scenario."""
         if ally:  # use new SC2 unit types
-            type_id = unit.unit_type - self._min_unit_type
-        else:  # use default SC2 unit types
-            if self.map_type == "stalkers_and_zealots":
-                # id(Stalker) = 74, id(Zealot) = 73
-                # Notice that one-hot zealot unit type in enemy_obs will be [1, 0] but [0, 1] in ally_obs
-                # If you want to align the enemy unit type with the ally's, uncomment the following lines
-                # if unit.unit_type == 74:
-                #     type_id = 0
-                # else:
-                #     type_id = 1
-                type_id = unit.unit_type - 73
-            elif self.map_type == "colossi_stalkers_zealots":
-                # id(Stalker) = 74, id(Zealot) = 73, id(Colossus) = 4
-                if unit.unit_type == 4:
-                    type_id = 0
-                elif unit.unit_type == 74:
-                    type_id = 1
-                else:
-                    type_id = 2
-            elif self.map_type == "bane":
-                # id(Baneling) = 9
-                if unit.unit_type == 9:
-                    type_id = 0
-                else:
-                    type_id = 1
-            elif self.map_type == "MMM":
-                # id(Marauder) = 51, id(Marine) = 48, id(Medivac) = 54
-                if unit.unit_type == 51:
-                    type_id = 0
-                elif unit.unit_type == 48:
-                    type_id = 1
-                else:
-                    type_id = 2
-
-        return type_id
+            return unit.unit_type - self._min_unit_type
+        # use default SC2 unit types
+        return int(
+            self._lookup_unit_types(self._enemy_type_id_table, unit.unit_type)
+        )
 
+    @step_cached
     def get_avail_agent_actions(self, agent_id):
-        """Returns the available actions for agent_id."""
+        """Returns the available actions for agent_id, as a new list
+        which the caller may modify.
+        """
+        if self.vectorized:
+            return self.get_avail_actions_array()[agent_id].tolist()
+
         unit = self.get_unit_by_id(agent_id)
         if unit.health > 0:
             # cannot choose no-op when alive
@@ -1442,9 +2218,8 @@ class StarCraft2Env(MultiAgentEnv):
                 avail_actions[5] = 1
 
             # Can attack only alive units that are alive in the shooting range
-            shoot_range = self.unit_shoot_range(agent_id)
-
             target_items = self.enemies.items()
+            target_offset = self.n_agents
             if self.map_type == "MMM" and unit.unit_type == self.medivac_id:
                 # Medivacs cannot heal themselves or other flying units
                 target_items = [
@@ -1452,14 +2227,11 @@ class StarCraft2Env(MultiAgentEnv):
                     for (t_id, t_unit) in self.agents.items()
                     if t_unit.unit_type != self.medivac_id
                 ]
+                target_offset = 0
 
-            for t_id, t_unit in target_items:
-                if t_unit.health > 0:
-                    dist = self.distance(
-                        unit.pos.x, unit.pos.y, t_unit.pos.x, t_unit.pos.y
-                    )
-                    if dist <= shoot_range:
-                        avail_actions[t_id + self.n_actions_no_attack] = 1
+            for t_id, _ in target_items:
+                if self._shoot_mask[agent_id, target_offset + t_id]:
+                    avail_actions[t_id + self.n_actions_no_attack] = 1
 
             return avail_actions
 
@@ -1467,21 +2239,111 @@ class StarCraft2Env(MultiAgentEnv):
             # only no-op allowed
             return [1] + [0] * (self.n_actions - 1)
 
-    def get_avail_actions(self):
-        """Returns the available actions of all agents in a list."""
+    @step_cached
+    def get_avail_actions(self, out=None):
+        """Returns the available actions of all agents in a new list of
+        lists, which the caller may modify.
+
+        If ``out`` is given, the available actions are instead written into
+        this uint8 array of shape (n_agents, n_actions), which is returned.
+        """
+        if self.vectorized:
+            if out is not None:
+                return self.get_avail_actions_array(out=out)
+            return self.get_avail_actions_array().tolist()
+        if out is not None:
+            for agent_id in range(self.n_agents):
+                out[agent_id] = self.get_avail_agent_actions(agent_id)
+            return out
         avail_actions = []
         for agent_id in range(self.n_agents):
             avail_agent = self.get_avail_agent_actions(agent_id)
             avail_actions.append(avail_agent)
         return avail_actions
 
+    @step_cached
+    def get_avail_actions_array(self, out=None):
+        """Returns the available actions of all agents as a uint8 array of
+        shape (n_agents, n_actions), optionally writing them into ``out``.
+        This is a vectorised equivalent of get_avail_agent_actions. The
+        returned array is a new copy, which the caller may modify.
+        """
+        if out is None:
+            out = np.zeros((self.n_agents, self.n_actions), dtype=np.uint8)
+        else:
+            out[...] = 0
+
+        units = self.unit_arrays
+        x = units.x[units.ally]
+        y = units.y[units.ally]
+        alive = units.alive[units.ally]
+
+        # Dead agents can only choose no-op, alive agents can always stop
+        out[:, 0] = ~alive
+        out[:, 1] = alive
+
+        # Look up all move targets at once, in the order of Direction
+        m = self._move_amount / 2
+        move_x = (x[:, None] + [0, 0, m, -m]).astype(int)
+        move_y = (y[:, None] + [m, -m, 0, 0]).astype(int)
+        pad, grid = self._get_padded_pathing_grid()
+        can_move = grid[
+            np.clip(move_x + pad, 0, grid.shape[0] - 1),
+            np.clip(move_y + pad, 0, grid.shape[1] - 1),
+        ]
+        moves = slice(2, 2 + self.n_actions_move)
+        out[:, moves] = can_move & alive[:, None]
+
+        # Can attack only alive units that are alive in the shooting range
+        targets = slice(
+            self.n_actions_no_attack, self.n_actions_no_attack + self.n_enemies
+        )
+        out[:, targets] = self._shoot_mask[:, self.n_agents :]  # noqa
+
+        if self.map_type == "MMM":
+            # Medivacs heal allies instead of attacking enemies, but cannot
+            # heal themselves or other flying units
+            medivacs = units.unit_type[units.ally] == self.medivac_id
+            heal_targets = self._shoot_mask[medivacs, : self.n_agents]
+            out[medivacs, self.n_actions_no_attack :] = 0  # noqa
+            out[
+                medivacs,
+                self.n_actions_no_attack : self.n_actions_no_attack  # noqa
+                + self.n_agents,
+            ] = (heal_targets & ~medivacs)
+
+        return out
+
+    def _get_padded_pathing_grid(self):
+        """Returns the pathing grid within the map bounds surrounded by a
+        non-pathable border, together with the border width. Indexing it at
+        positions offset by the border width avoids explicit bounds checks.
+        """
+        source, pad, padded = self._padded_pathing_grid
+        if source is not self.pathing_grid:
+            pad = int(math.ceil(self._move_amount / 2)) + 1
+            padded = np.zeros(
+                (self.map_x + 2 * pad, self.map_y + 2 * pad), dtype=bool
+            )
+            grid = self.pathing_grid[: self.map_x, : self.map_y]
+            padded[
+                pad : pad + grid.shape[0], pad : pad + grid.shape[1]  # noqa
+            ] = grid
+            self._padded_pathing_grid = (self.pathing_grid, pad, padded)
+        return pad, padded
+
     def close(self):
         """Close StarCraft II."""
         if self.renderer is not None:
             self.renderer.close()
             self.renderer = None
+        if self._step_executor is not None:
+            self._step_executor.shutdown(wait=True)
+            self._step_executor = self._step_future = None
         if self._sc2_proc:
             self._sc2_proc.close()
+        if self._recorder is not None:
+            self._recorder.close()
 
     def seed(self):
         """Returns the random seed used by the environment."""
@@ -1497,78 +2359,132 @@ class StarCraft2Env(MultiAgentEnv):
         ), "mode must be consistent across render calls"
         return self.renderer.render(mode)
 
-    def _kill_all_units(self):
-        """Kill all units on the map."""
-        units_alive = [
-            unit.tag for unit in self.agents.values() if unit.health > 0
-        ] + [unit.tag for unit in self.enemies.values() if unit.health > 0]
-        debug_command = [
+    def _get_kill_all_units_command(self):
+        """Returns the debug command killing all units on the map, including
+        those respawned by the map's trigger after a fast reset.
+        """
+        units_alive = (
+            [unit.tag for unit in self.agents.values() if unit.health > 0]
+            + [unit.tag for unit in self.enemies.values() if unit.health > 0]
+            + self._respawned_tags
+        )
+        return [
             d_pb.DebugCommand(kill_unit=d_pb.DebugKillUnit(tag=units_alive))
         ]
-        self._controller.debug(debug_command)
 
     def init_units(self):
         """Initialise the units."""
-        while True:
-            # Sometimes not all units have yet been created by SC2
-            self.agents = {}
-            self.enemies = {}
-
-            ally_units = [
-                unit
-                for unit in self._obs.observation.raw_data.units
-                if unit.owner == 1
-            ]
-            ally_units_sorted = sorted(
-                ally_units,
-                key=attrgetter("unit_type", "pos.x", "pos.y"),
-                reverse=False,
-            )
+        # Sometimes not all units have yet been created by SC2
+        while not self._init_units_from_obs():
+            try:
+                if self._fast_reset_failed():
+                    self._restart()
+                self._obs = self._step_and_observe(1)
+            except (protocol.ProtocolError, protocol.ConnectionError):
+                self.full_restart()
+                self.reset()
 
-            for i in range(len(ally_units_sorted)):
-                self.agents[i] = ally_units_sorted[i]
-                if self.debug:
-                    logging.debug(
-                        "Unit {} is {}, x = {}, y = {}".format(
-                            len(self.agents),
-                            self.agents[i].unit_type,
-                            self.agents[i].pos.x,
-                            self.agents[i].pos.y,
-                        )
-                    )
+    def _init_units_from_obs(self):
+        """Initialise the units from the current observation. Returns
+        whether all units have been created.
+        """
+        self.agents = {}
+        self.enemies = {}
 
-            for unit in self._obs.observation.raw_data.units:
-                if unit.owner == 2:
-                    self.enemies[len(self.enemies)] = unit
-                    if self._episode_count == 0:
-                        self.max_reward += unit.health_max + unit.shield_max
+        ally_units = [
+            unit
+            for unit in self._obs.observation.raw_data.units
+            if unit.owner == 1
+        ]
+        ally_units_sorted = sorted(
+            ally_units,
+            key=attrgetter("unit_type", "pos.x", "pos.y"),
+            reverse=False,
+        )
 
-            if self._episode_count == 0:
-                min_unit_type = min(
-                    unit.unit_type for unit in self.agents.values()
+        for i in range(len(ally_units_sorted)):
+            self.agents[i] = ally_units_sorted[i]
+            if self.debug:
+                logging.debug(
+                    "Unit {} is {}, x = {}, y = {}".format(
+                        len(self.agents),
+                        self.agents[i].unit_type,
+                        self.agents[i].pos.x,
+                        self.agents[i].pos.y,
+                    )
                 )
-                self._init_ally_unit_types(min_unit_type)
 
-            all_agents_created = len(self.agents) == self.n_agents
-            all_enemies_created = len(self.enemies) == self.n_enemies
+        for unit in self._obs.observation.raw_data.units:
+            if unit.owner == 2:
+                self.enemies[len(self.enemies)] = unit
+                if not self._unit_types_initialised:
+                    self.max_reward += unit.health_max + unit.shield_max
 
-            self._unit_types = [
-                unit.unit_type for unit in ally_units_sorted
-            ] + [
-                unit.unit_type
-                for unit in self._obs.observation.raw_data.units
-                if unit.owner == 2
-            ]
+        if not self._unit_types_initialised:
+            min_unit_type = min(
+                unit.unit_type for unit in self.agents.values()
+            )
+            self._init_ally_unit_types(min_unit_type)
 
-            if all_agents_created and all_enemies_created:  # all good
-                return
+        all_agents_created = len(self.agents) == self.n_agents
+        all_enemies_created = len(self.enemies) == self.n_enemies
 
-            try:
-                self._controller.step(1)
-                self._obs = self._controller.observe()
-            except (protocol.ProtocolError, protocol.ConnectionError):
-                self.full_restart()
-                self.reset()
+        self._unit_types = [unit.unit_type for unit in ally_units_sorted] + [
+            unit.unit_type
+            for unit in self._obs.observation.raw_data.units
+            if unit.owner == 2
+        ]
+
+        if all_agents_created and all_enemies_created:  # all good
+            self._ally_tag_ids = {
+                unit.tag: al_id for al_id, unit in self.agents.items()
+            }
+            self._enemy_tag_ids = {
+                unit.tag: e_id for e_id, unit in self.enemies.items()
+            }
+            self._update_unit_arrays()
+            self._unit_types_initialised = True
+            if self._fast_reset and self._respawn_commands is None:
+                self._respawn_commands = self._get_respawn_commands()
+            return True
+        return False
+
+    def _update_unit_arrays(self):
+        """Decode the current units into the unit arrays and update the
+        distances between them. Should be called whenever the units are
+        updated.
+        """
+        self.unit_arrays.update(
+            [self.agents[i] for i in range(self.n_agents)]
+            + [self.enemies[i] for i in range(self.n_enemies)]
+        )
+        self._update_distances()
+
+    def _update_distances(self):
+        """Compute the distances from every agent to every unit, together
+        with masks of the units that are within the sight and shooting range
+        of each agent. Columns follow the layout of get_visibility_matrix.
+        """
+        x = self.unit_arrays.x
+        y = self.unit_arrays.y
+        alive = self.unit_arrays.alive
+
+        self._delta_x = x[None, :] - x[: self.n_agents, None]
+        self._delta_y = y[None, :] - y[: self.n_agents, None]
+        self._distances = np.hypot(self._delta_x, self._delta_y)
+
+        sight_range = np.array(
+            [self.unit_sight_range(i) for i in range(self.n_agents)]
+        )
+        shoot_range = np.array(
+            [self.unit_shoot_range(i) for i in range(self.n_agents)]
+        )
+        # Only alive agents see or shoot, and only alive units other than
+        # themselves
+        in_play = alive[: self.n_agents, None] & alive[None, :]
+        in_play[:, : self.n_agents] &= ~np.eye(self.n_agents, dtype=bool)
+        self._sight_mask = in_play & (self._distances < sight_range[:, None])
+        self._shoot_mask = in_play & (self._distances <= shoot_range[:, None])
 
     def get_unit_types(self):
         if self._unit_types is None:
@@ -1583,48 +2499,67 @@ class StarCraft2Env(MultiAgentEnv):
         """Update units after an environment step.
         This function assumes that self._obs is up-to-date.
         """
-        n_ally_alive = 0
-        n_enemy_alive = 0
-
-        # Store previous state
-        self.previous_ally_units = deepcopy(self.agents)
-        self.previous_enemy_units = deepcopy(self.enemies)
-
-        for al_id, al_unit in self.agents.items():
-            updated = False
-            for unit in self._obs.observation.raw_data.units:
-                if al_unit.tag == unit.tag:
-                    self.agents[al_id] = unit
-                    updated = True
-                    n_ally_alive += 1
-                    break
-
+        # Store previous health and shield for computing the reward. The
+        # unit arrays are replaced on update, so no copies are needed
+        units = self.unit_arrays
+        self.previous_ally_health = units.health[units.ally]
+        self.previous_ally_shield = units.shield[units.ally]
+        self.previous_enemy_health = units.health[units.enemy]
+        self.previous_enemy_shield = units.shield[units.enemy]
+
+        ally_updated = [False] * self.n_agents
+        enemy_updated = [False] * self.n_enemies
+        # Alive units that are not (ally) medivacs, see only_medivac_left
+        ally_non_medivac_types = []
+        enemy_non_medivac_types = []
+
+        unknown_tags = []
+
+        for unit in self._obs.observation.raw_data.units:
+            al_id = self._ally_tag_ids.get(unit.tag)
+            if al_id is not None:
+                self.agents[al_id] = unit
+                ally_updated[al_id] = True
+                if unit.health > 0 and unit.unit_type != self.medivac_id:
+                    ally_non_medivac_types.append(unit.unit_type)
+                continue
+            e_id = self._enemy_tag_ids.get(unit.tag)
+            if e_id is not None:
+                self.enemies[e_id] = unit
+                enemy_updated[e_id] = True
+                if unit.health > 0 and unit.unit_type != self.medivac_id:
+                    enemy_non_medivac_types.append(unit.unit_type)
+            elif unit.owner in (1, 2):
+                unknown_tags.append(unit.tag)
+
+        for al_id, updated in enumerate(ally_updated):
             if not updated:  # dead
-                al_unit.health = 0
-
-        for e_id, e_unit in self.enemies.items():
-            updated = False
-            for unit in self._obs.observation.raw_data.units:
-                if e_unit.tag == unit.tag:
-                    self.enemies[e_id] = unit
-                    updated = True
-                    n_enemy_alive += 1
-                    break
-
+                self.agents[al_id].health = 0
+        for e_id, updated in enumerate(enemy_updated):
             if not updated:  # dead
-                e_unit.health = 0
+                self.enemies[e_id].health = 0
 
-        if (
-            n_ally_alive == 0
-            and n_enemy_alive > 0
-            or self.only_medivac_left(ally=True)
-        ):
+        n_ally_alive = sum(ally_updated)
+        n_enemy_alive = sum(enemy_updated)
+        only_medivac_left_ally = self.only_medivac_left(
+            ally=True, non_medivac_types=ally_non_medivac_types
+        )
+        only_medivac_left_enemy = self.only_medivac_left(
+            ally=False, non_medivac_types=enemy_non_medivac_types
+        )
+
+        self._update_unit_arrays()
+
+        if unknown_tags and self._respawn_commands is not None:
+            # The map's trigger respawned the units after a fast reset, so
+            # the next reset kills them and waits for the trigger instead
+            self._disable_fast_reset()
+            self._respawned_tags = unknown_tags
+            return None
+
+        if n_ally_alive == 0 and n_enemy_alive > 0 or only_medivac_left_ally:
             return -1  # lost
-        if (
-            n_ally_alive > 0
-            and n_enemy_alive == 0
-            or self.only_medivac_left(ally=False)
-        ):
+        if n_ally_alive > 0 and n_enemy_alive == 0 or only_medivac_left_enemy:
             return 1  # won
         if n_ally_alive == 0 and n_enemy_alive == 0:
             return 0
@@ -1660,36 +2595,125 @@ class StarCraft2Env(MultiAgentEnv):
         elif self.map_type == "bane":
             self.baneling_id = min_unit_type
             self.zergling_id = min_unit_type + 1
+        self._init_unit_type_tables()
 
-    def only_medivac_left(self, ally):
-        """Check if only Medivac units are left."""
+    def _init_unit_type_tables(self):
+        """Initialise the lookup arrays indexed by SC2 unit type that back
+        unit_max_cooldown, unit_max_shield and get_unit_type_id. Should be
+        called whenever the unit type ids change.
+        """
+        self._max_cooldown_table = self._build_unit_type_table(
+            [
+                (self.marine_id, 15),
+                (self.marauder_id, 25),
+                (self.medivac_id, 200),  # max energy
+                (self.stalker_id, 35),
+                (self.zealot_id, 22),
+                (self.colossus_id, 24),
+                (self.hydralisk_id, 10),
+                (self.zergling_id, 11),
+                (self.baneling_id, 1),
+            ],
+            default=15,
+        )
+        # Unit types without shields map to NaN
+        self._max_shield_table = self._build_unit_type_table(
+            [
+                (4, 150),  # Protoss's Colossus
+                (self.colossus_id, 150),
+                (73, 50),  # Protoss's Zealot
+                (self.zealot_id, 50),
+                (74, 80),  # Protoss's Stalker
+                (self.stalker_id, 80),
+            ],
+            default=np.nan,
+        )
+
+        # Allies use new SC2 unit types, numbered from the smallest one. Type
+        # ids of -1 mark unit types that are not in the scenario
+        self._ally_type_id_table = self._build_unit_type_table(
+            [
+                (self._min_unit_type + type_id, type_id)
+                for type_id in range(max(self.unit_type_bits, 1))
+            ],
+            default=-1,
+        ).astype(np.int64)
+        # Enemies use default SC2 unit types
+        if self.map_type == "stalkers_and_zealots":
+            # id(Stalker) = 74, id(Zealot) = 73
+            # Notice that one-hot zealot unit type in enemy_obs will be
+            # [1, 0] but [0, 1] in ally_obs
+            enemy_type_ids, default = [(73, 0), (74, 1)], -1
+        elif self.map_type == "colossi_stalkers_zealots":
+            # id(Stalker) = 74, id(Zealot) = 73, id(Colossus) = 4
+            enemy_type_ids, default = [(4, 0), (74, 1)], 2
+        elif self.map_type == "bane":
+            # id(Baneling) = 9
+            enemy_type_ids, default = [(9, 0)], 1
+        elif self.map_type == "MMM":
+            # id(Marauder) = 51, id(Marine) = 48, id(Medivac) = 54
+            enemy_type_ids, default = [(51, 0), (48, 1)], 2
+        else:
+            enemy_type_ids, default = [], -1
+        self._enemy_type_id_table = self._build_unit_type_table(
+            enemy_type_ids, default
+        ).astype(np.int64)
+
+        # One-hot encodings of the type ids, with no bit set for unit types
+        # not in the scenario
+        one_hot = np.vstack(
+            [np.eye(self.unit_type_bits), np.zeros((1, self.unit_type_bits))]
+        )
+        self._ally_type_one_hot_table = one_hot[self._ally_type_id_table]
+        self._enemy_type_one_hot_table = one_hot[self._enemy_type_id_table]
+
+    @staticmethod
+    def _build_unit_type_table(values, default):
+        """Returns an array indexed by SC2 unit type, holding the value of
+        the unit types given as (unit_type, value) pairs and ``default`` for
+        all others. Later pairs take precedence. The last entry holds the
+        default for all unit types beyond the array, see _lookup_unit_types.
+        """
+        size = max([unit_type for unit_type, _ in values], default=0) + 2
+        table = np.full(size, default, dtype=np.float64)
+        for unit_type, value in values:
+            table[unit_type] = value
+        return table
+
+    @staticmethod
+    def _lookup_unit_types(table, unit_types):
+        """Returns the entries of a unit type table for the given unit
+        types.
+        """
+        return table[np.minimum(unit_types, len(table) - 1)]
+
+    def only_medivac_left(self, ally, non_medivac_types=None):
+        """Check if only Medivac units are left.
+
+        non_medivac_types lists the unit types of the alive units that are
+        not (ally) medivacs. It is collected from the current units if not
+        given, e.g. by update_units, which counts them while updating.
+        """
         if self.map_type != "MMM":
             return False
 
-        if ally:
-            units_alive = [
-                a
-                for a in self.agents.values()
-                if (a.health > 0 and a.unit_type != self.medivac_id)
-            ]
-            if len(units_alive) == 0:
-                return True
-            return False
-        else:
-            units_alive = [
-                a
-                for a in self.enemies.values()
+        if non_medivac_types is None:
+            units = self.agents if ally else self.enemies
+            non_medivac_types = [
+                a.unit_type
+                for a in units.values()
                 if (a.health > 0 and a.unit_type != self.medivac_id)
             ]
-            if len(units_alive) == 1 and units_alive[0].unit_type == 54:
-                return True
-            return False
+        if ally:
+            return len(non_medivac_types) == 0
+        return non_medivac_types == [54]
 
     def get_unit_by_id(self, a_id):
         """Get unit by ID."""
         return self.agents[a_id]
 
     def get_stats(self):
+        n_resets = max(self._n_timed_resets, 1)
         stats = {
             "battles_won": self.battles_won,
             "battles_game": self.battles_game,
@@ -1697,9 +2721,113 @@ class StarCraft2Env(MultiAgentEnv):
             "win_rate": self.battles_won / self.battles_game,
             "timeouts": self.timeouts,
             "restarts": self.force_restarts,
+            "step_cache_hits": self._step_cache_hits,
+            "step_cache_misses": self._step_cache_misses,
+            "reset_time_mean": self._reset_time / n_resets,
+            "reset_game_loops_mean": self._reset_game_loops / n_resets,
         }
+        stats.update(self._supervisor.get_stats())
+        stats.update(map_data_cache.get_stats())
+        if self._timer is not None:
+            stats.update(self._timer.get_stats())
         return stats
 
+    def _clear_step_cache(self):
+        """Discard the values memoised for the current step."""
+        self._step_cache.clear()
+        self._step_cache_key = self._episode_steps
+
+    def _get_buffer_specs(self):
+        """Returns the name, shape and dtype of the arrays holding the
+        actions, observations, state, available actions, reward and
+        termination flag of a step.
+        """
+        obs_size = self._get_obs_row_size()
+        if self.obs_instead_of_state:
+            state_size = self.n_agents * obs_size
+        else:
+            state_size = self.get_state_size()
+        return [
+            ("actions", (self.n_agents,), np.int64),
+            ("obs", (self.n_agents, obs_size), np.float32),
+            ("state", (state_size,), np.float32),
+            ("avail_actions", (self.n_agents, self.n_actions), np.uint8),
+            ("reward", (), np.float64),
+            ("terminated", (), np.bool_),
+        ]
+
+    def rollout(self, policy_fn, max_steps=None, out=None):
+        """Reset the environment and run an episode of at most max_steps
+        steps, choosing the actions with policy_fn, which is called as
+        policy_fn(obs, state, avail_actions) and returns the actions of the
+        agents.
+
+        The actions, observations, state, available actions, reward and
+        termination flag of every step are written into arrays of
+        episode_limit + 1 rows: one per step, plus one for the observations,
+        state and available actions after the last step. Newly allocated
+        arrays are zero after the episode. The arrays are returned in a
+        dictionary, in which "length" is the number of steps and "info" the
+        info of the last step.
+
+        Parameters
+        ----------
+        policy_fn : callable
+            The policy, given the observations, state and available actions
+            of the step as rows of the arrays, which must not be modified.
+        max_steps : int, optional
+            The maximum number of steps (default is None, in which case the
+            episode runs until it terminates).
+        out : dict, optional
+            Arrays of the shapes and dtypes described above, e.g. slices of
+            a replay buffer, into which the episode is written instead of
+            newly allocated ones (default is None).
+        """
+        out, max_steps = self._init_rollout(out, max_steps)
+        actions = out["actions"]
+
+        self.reset()
+        t = 0
+        info = {}
+        while t < max_steps:
+            actions[t] = policy_fn(*self._write_rollout_observations(out, t))
+            reward, terminated, info = self.step(actions[t])
+            out["reward"][t] = reward
+            out["terminated"][t] = terminated
+            t += 1
+            if terminated:
+                break
+        self._write_rollout_observations(out, t)
+
+        batch = dict(out)
+        batch["length"] = t
+        batch["info"] = info
+        return batch
+
+    def _init_rollout(self, out, max_steps):
+        """Returns the arrays of a rollout, allocating them if out is None,
+        and its maximum number of steps.
+        """
+        if out is None:
+            n_rows = self.episode_limit + 1
+            out = {
+                name: np.zeros((n_rows,) + shape, dtype=dtype)
+                for name, shape, dtype in self._get_buffer_specs()
+            }
+        if max_steps is None or max_steps > self.episode_limit:
+            max_steps = self.episode_limit
+        return out, max_steps
+
+    def _write_rollout_observations(self, out, t):
+        """Writes the observations, state and available actions into row t
+        of the arrays of a rollout, and returns these rows.
+        """
+        rows = out["obs"][t], out["state"][t], out["avail_actions"][t]
+        self.get_obs(out=rows[0])
+        self.get_state(out=rows[1])
+        self.get_avail_actions(out=rows[2])
+        return rows
+
     def get_env_info(self):
         env_info = super().get_env_info()
         env_info["agent_features"] = self.ally_state_attr_names
@@ -0,0 +1,135 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import functools
+import os
+import time
+
+RESTART_CAUSES = ("error", "episodes", "rss", "latency")
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):  # not available on Windows
+    _PAGE_SIZE = None
+
+
+def read_rss(pid):
+    """Returns the resident set size of a process in bytes, read from
+    /proc, or None if it is not available.
+    """
+    if pid is None or _PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/{}/statm".format(pid)) as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class ProcessSupervisor(object):
+    """Watches the health of the StarCraft II process of an environment and
+    decides when the process should be recycled, i.e. replaced by a new one
+    between episodes, before it fails in the middle of one.
+
+    A process is recycled once it has played a number of episodes, once its
+    resident memory exceeds a threshold, or once its recent steps have
+    become slow on average. The number and durations of restarts are kept
+    for every cause, including errors, which lead to full restarts.
+    """
+
+    def __init__(
+        self,
+        max_episodes=None,
+        max_rss_mb=None,
+        max_step_latency=None,
+        latency_window=100,
+    ):
+        """Create a supervisor.
+
+        Parameters
+        ----------
+        max_episodes : int, optional
+            The number of episodes after which a process is recycled
+            (default is None, in which case processes are not recycled
+            after a number of episodes).
+        max_rss_mb : float, optional
+            The resident memory in megabytes above which a process is
+            recycled (default is None, in which case memory is not
+            checked).
+        max_step_latency : float, optional
+            The mean latency in seconds of the requests of a step above
+            which a process is recycled (default is None, in which case
+            latency is not checked).
+        latency_window : int, optional
+            The number of most recent steps over which the latency is
+            averaged (default is 100).
+        """
+        self.max_episodes = max_episodes
+        self.max_rss_mb = max_rss_mb
+        self.max_step_latency = max_step_latency
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._episodes = 0
+        self._restarts = dict.fromkeys(RESTART_CAUSES, 0)
+        self._restart_time = dict.fromkeys(RESTART_CAUSES, 0.0)
+
+    def start_process(self):
+        """Forget the episodes and latencies of the previous process."""
+        self._episodes = 0
+        self._latencies.clear()
+
+    def start_episode(self):
+        self._episodes += 1
+
+    def record_latency(self, seconds):
+        """Record the latency of the requests of a step."""
+        self._latencies.append(seconds)
+
+    def track_latency(self, func):
+        """Returns func recording its latency as that of a step."""
+        perf_counter = time.perf_counter
+        record = self._latencies.append
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            result = func(*args, **kwargs)
+            record(perf_counter() - start)
+            return result
+
+        return timed
+
+    def get_recycle_cause(self, pid):
+        """Returns why the process with the given pid should be recycled,
+        or None if it should not.
+        """
+        if self.max_episodes is not None:
+            if self._episodes >= self.max_episodes:
+                return "episodes"
+        if self.max_rss_mb is not None:
+            rss = read_rss(pid)
+            if rss is not None and rss > self.max_rss_mb * 2**20:
+                return "rss"
+        if self.max_step_latency is not None and self._latencies:
+            latency = sum(self._latencies) / len(self._latencies)
+            if latency > self.max_step_latency:
+                return "latency"
+        return None
+
+    def record_restart(self, cause, seconds):
+        """Record a restart of the process and its duration."""
+        self._restarts[cause] += 1
+        self._restart_time[cause] += seconds
+
+    def get_stats(self):
+        """Returns the number and mean duration in seconds of the restarts
+        of every cause, e.g. {"restarts_rss": 1, "restart_time_rss": ...}.
+        """
+        stats = {}
+        for cause in RESTART_CAUSES:
+            n_restarts = self._restarts[cause]
+            mean_time = self._restart_time[cause] / max(n_restarts, 1)
+            stats["restarts_" + cause] = n_restarts
+            stats["restart_time_" + cause] = mean_time
+        return stats
@@ -0,0 +1,125 @@
+from collections import Counter
+
+from smac.bin.benchmark import benchmark, register_scaled_map
+from smac.env.starcraft2.fake_sc2 import (
+    MAP_TYPE_UNITS,
+    MAP_UNITS,
+    FakeRunConfig,
+)
+from smac.env.starcraft2.maps import smac_maps
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+import numpy as np
+import pytest
+
+map_names = sorted(smac_maps.get_smac_map_registry())
+
+
+def make_env(map_name, **kwargs):
+    return StarCraft2Env(
+        map_name=map_name, run_config=FakeRunConfig(seed=0), **kwargs
+    )
+
+
+def run_episode(env, rng):
+    """Runs random agents until the episode terminates. Returns the number
+    of steps and the info of the last step.
+    """
+    n_steps = 0
+    terminated = False
+    while not terminated:
+        actions = [
+            rng.choice(np.flatnonzero(avail))
+            for avail in env.get_avail_actions()
+        ]
+        _, terminated, info = env.step(actions)
+        n_steps += 1
+    return n_steps, info
+
+
+def get_unit_counts(env):
+    """Returns the numbers of allies and enemies of each standard unit
+    type.
+    """
+    ally_types = MAP_TYPE_UNITS[env.map_type]
+    allies = Counter(
+        ally_types[unit.unit_type - env._min_unit_type]
+        for unit in env.agents.values()
+    )
+    enemies = Counter(unit.unit_type for unit in env.enemies.values())
+    return allies, enemies
+
+
+def test_every_map_has_units():
+    assert set(map_names) <= set(MAP_UNITS)
+
+
+@pytest.mark.parametrize("map_name", ["3m", "2s3z", "MMM2", "corridor"])
+def test_episodes(map_name):
+    env = make_env(map_name)
+    rng = np.random.RandomState(0)
+    try:
+        for episode in range(1, 4):
+            obs, state = env.reset()
+            assert len(obs) == env.n_agents
+            assert obs[0].shape == (env.get_obs_size(),)
+            assert state.shape == (env.get_state_size(),)
+            n_steps, info = run_episode(env, rng)
+            assert n_steps <= env.episode_limit
+            assert set(info) >= {"battle_won", "dead_allies", "dead_enemies"}
+            if n_steps < env.episode_limit:
+                all_allies_dead = info["dead_allies"] == env.n_agents
+                assert info["battle_won"] or all_allies_dead
+            assert env.battles_game == episode
+    finally:
+        env.close()
+
+
+def test_episode_limit():
+    env = make_env("3m", heuristic_ai=True)
+    try:
+        env.reset()
+        n_steps, info = run_episode(env, np.random.RandomState(0))
+        assert n_steps == env.episode_limit
+        assert not info["battle_won"]
+        assert info["dead_enemies"] > info["dead_allies"]
+        assert env.battles_game == env.timeouts == 1
+    finally:
+        env.close()
+
+
+@pytest.mark.parametrize("map_name", map_names)
+def test_map_units(map_name):
+    env = make_env(map_name)
+    try:
+        env.reset()
+        allies, enemies = get_unit_counts(env)
+        assert allies == Counter(dict(MAP_UNITS[map_name][0]))
+        assert enemies == Counter(dict(MAP_UNITS[map_name][1]))
+        assert sum(allies.values()) == env.n_agents
+        assert sum(enemies.values()) == env.n_enemies
+        assert all(unit.health > 0 for unit in env.agents.values())
+        assert all(unit.health > 0 for unit in env.enemies.values())
+    finally:
+        env.close()
+
+
+@pytest.mark.parametrize("map_name", ["3m", "2s3z", "MMM2", "2s_vs_1sc"])
+def test_scaled_maps(map_name):
+    scaled_name = register_scaled_map(map_name, 3)
+    env = make_env(scaled_name)
+    try:
+        env.reset()
+        params = smac_maps.get_smac_map_registry()[map_name]
+        assert env.n_agents == 3 * params["n_agents"]
+        assert env.n_enemies == 3 * params["n_enemies"]
+        allies, enemies = get_unit_counts(env)
+        for units, counts in zip(MAP_UNITS[map_name], (allies, enemies)):
+            scaled = {unit_type: 3 * n for unit_type, n in units}
+            assert counts == Counter(scaled)
+        n_steps, _ = run_episode(env, np.random.RandomState(0))
+        assert n_steps <= env.episode_limit
+    finally:
+        env.close()
+    result = benchmark(scaled_name, n_steps=20)
+    assert result["agents"] == 3 * params["n_agents"]
+    assert result["steps/s"] > 0
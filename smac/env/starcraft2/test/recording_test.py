@@ -0,0 +1,81 @@
+from smac.env.starcraft2.fake_sc2 import FakeRunConfig
+from smac.env.starcraft2.recording import read_stream, replay
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+import numpy as np
+import pytest
+
+env_flags = [
+    {},
+    dict(obs_last_action=True, obs_timestep_number=True),
+    dict(
+        fast_reset=True,
+        pipeline_requests=True,
+        timing=True,
+        recycle_episodes=2,
+    ),
+]
+
+
+def get_step(env, reward, terminated, info):
+    return dict(
+        obs=np.array(env.get_obs()),
+        state=env.get_state(),
+        avail_actions=env.get_avail_actions(),
+        reward=reward,
+        terminated=terminated,
+        info=info,
+    )
+
+
+def assert_steps_equal(replayed, recorded):
+    assert len(replayed) == len(recorded)
+    for step, ref_step in zip(replayed, recorded):
+        np.testing.assert_array_equal(step.pop("obs"), ref_step.pop("obs"))
+        np.testing.assert_array_equal(
+            step.pop("state"), ref_step.pop("state")
+        )
+        assert step == ref_step
+
+
+@pytest.mark.parametrize("flags", env_flags)
+def test_record_and_replay(tmp_path, flags):
+    path = str(tmp_path / "stream.gz")
+    env = StarCraft2Env(
+        map_name="3m",
+        run_config=FakeRunConfig(seed=0),
+        record_path=path,
+        vectorized=True,
+        **flags
+    )
+    rng = np.random.RandomState(0)
+    recorded = []
+    try:
+        for map_name, n_steps in (("3m", 250), ("2s3z", 5), ("MMM2", 100)):
+            if map_name != env.map_name:
+                env.switch_map(map_name)
+            env.reset()
+            for _ in range(n_steps):
+                actions = [
+                    rng.choice(np.flatnonzero(avail))
+                    for avail in env.get_avail_actions()
+                ]
+                reward, terminated, info = env.step(actions)
+                recorded.append(get_step(env, reward, terminated, info))
+                if terminated:
+                    env.reset()
+        stats = env.get_stats()
+    finally:
+        env.close()
+    assert read_stream(path)
+
+    replayed = []
+
+    def step_callback(env, reward, terminated, info):
+        replayed.append(get_step(env, reward, terminated, info))
+
+    replay_stats = replay(path, step_callback, vectorized=False, **flags)
+    assert_steps_equal(replayed, recorded)
+    for key in ("battles_won", "battles_game", "timeouts", "restarts"):
+        assert replay_stats[key] == stats[key]
+    if flags.get("recycle_episodes"):
+        assert stats["restarts_episodes"] > 0
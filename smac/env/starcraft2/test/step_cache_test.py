@@ -0,0 +1,141 @@
+from smac.env.starcraft2.fake_sc2 import FakeRunConfig
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+import numpy as np
+import pytest
+
+
+@pytest.fixture(params=[True, False], ids=["vectorized", "reference"])
+def env(request):
+    env = StarCraft2Env(
+        map_name="3m",
+        run_config=FakeRunConfig(seed=0),
+        vectorized=request.param,
+    )
+    env.reset()
+    yield env
+    env.close()
+
+
+def fill_cache(env):
+    env.get_obs()
+    env.get_obs_agent(0)
+    env.get_state()
+    env.get_avail_actions()
+    env.get_avail_agent_actions(0)
+    assert env._step_cache
+
+
+def test_computed_once_per_step(env):
+    env._clear_step_cache()
+    env.get_state()
+    misses, hits = env._step_cache_misses, env._step_cache_hits
+    env.get_state()
+    assert env._step_cache_misses == misses
+    assert env._step_cache_hits == hits + 1
+
+
+def test_keyword_arguments_share_entry(env):
+    obs = env.get_obs_agent(1)
+    avail_actions = env.get_avail_agent_actions(1)
+    misses = env._step_cache_misses
+    np.testing.assert_array_equal(env.get_obs_agent(agent_id=1), obs)
+    assert env.get_avail_agent_actions(agent_id=1) == avail_actions
+    assert env._step_cache_misses == misses
+
+
+def move_actions(env):
+    """Returns the first available move action of every agent."""
+    return [avail[2:6].index(1) + 2 for avail in env.get_avail_actions()]
+
+
+def assert_cache_current(env):
+    obs = env.get_obs()
+    state = env.get_state()
+    avail_actions = env.get_avail_actions()
+    env._clear_step_cache()
+    for agent_obs, fresh_obs in zip(obs, env.get_obs()):
+        np.testing.assert_array_equal(agent_obs, fresh_obs)
+    np.testing.assert_array_equal(state, env.get_state())
+    assert avail_actions == env.get_avail_actions()
+
+
+def test_cleared_by_step(env):
+    obs = env.get_obs()
+    fill_cache(env)
+    env.step(move_actions(env))
+    assert not env._step_cache
+    assert not all(np.array_equal(a, b) for a, b in zip(obs, env.get_obs()))
+    assert_cache_current(env)
+
+
+def test_cleared_by_reset(env):
+    for _ in range(3):
+        env.step([1] * env.n_agents)
+    fill_cache(env)
+    env.reset()
+    assert_cache_current(env)
+    # A reset right after a reset keeps the episode step counter at 0
+    fill_cache(env)
+    env.reset()
+    assert_cache_current(env)
+
+
+def test_cleared_by_full_restart(env):
+    fill_cache(env)
+    env.full_restart()
+    assert not env._step_cache
+    env.reset()
+    assert_cache_current(env)
+
+
+def test_cleared_by_switch_map(env):
+    fill_cache(env)
+    env.switch_map("8m")
+    assert not env._step_cache
+    obs, state = env.reset()
+    assert len(obs) == len(env.get_obs()) == 8
+    assert state.shape == env.get_state().shape == (env.get_state_size(),)
+    assert_cache_current(env)
+
+
+def test_returns_copies(env):
+    obs_agent = env.get_obs_agent(0)
+    obs_agent[:] = 99
+    assert not np.array_equal(env.get_obs_agent(0), obs_agent)
+
+    obs = env.get_obs()
+    obs[0][:] = 99
+    obs[1] = None
+    assert not (env.get_obs()[0] == 99).all()
+    assert env.get_obs()[1] is not None
+
+    state = env.get_state()
+    state[:] = 99
+    assert not (env.get_state() == 99).all()
+
+    avail_agent = env.get_avail_agent_actions(0)
+    avail_agent[0] = 7
+    assert env.get_avail_agent_actions(0)[0] != 7
+
+    avail = env.get_avail_actions()
+    avail[0][0] = 7
+    avail.pop()
+    assert env.get_avail_actions()[0][0] != 7
+    assert len(env.get_avail_actions()) == env.n_agents
+
+    avail_array = env.get_avail_actions_array()
+    avail_array[:] = 7
+    assert not (env.get_avail_actions_array() == 7).any()
+
+
+def test_out_arrays_match_cached_values(env):
+    obs = np.zeros((env.n_agents, env.get_obs_size()), np.float32)
+    state = np.zeros(env.get_state_size(), np.float32)
+    avail = np.zeros((env.n_agents, env.n_actions), np.uint8)
+    for _ in range(2):  # computed into out, then copied from the cache
+        assert env.get_obs(out=obs) is obs
+        assert env.get_state(out=state) is state
+        assert env.get_avail_actions(out=avail) is avail
+        np.testing.assert_array_equal(obs, np.array(env.get_obs()))
+        np.testing.assert_array_equal(state, env.get_state())
+        assert avail.tolist() == env.get_avail_actions()
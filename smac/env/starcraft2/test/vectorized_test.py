@@ -0,0 +1,103 @@
+from smac.env.starcraft2.fake_sc2 import FakeRunConfig
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+import numpy as np
+import pytest
+
+map_names = [
+    "3m",
+    "2s3z",
+    "MMM2",
+    "1c3s5z",
+    "3s_vs_5z",
+    "2s_vs_1sc",
+    "bane_vs_bane",
+    "corridor",
+]
+env_flags = [
+    {},
+    dict(obs_all_health=False),
+    dict(obs_all_health=False, obs_own_health=False),
+    dict(obs_last_action=True, state_last_action=False),
+    dict(obs_pathing_grid=True, obs_terrain_height=True),
+    dict(obs_timestep_number=True, state_timestep_number=True),
+    dict(obs_instead_of_state=True, obs_timestep_number=True),
+    dict(heuristic_ai=True),
+    dict(heuristic_ai=True, heuristic_rest=True),
+]
+
+
+def get_outputs(env):
+    return dict(
+        obs=env.get_obs(),
+        state=env.get_state(),
+        avail_actions=env.get_avail_actions(),
+        visibility=env.get_visibility_matrix(),
+    )
+
+
+def assert_outputs_equal(vectorized, reference):
+    assert len(vectorized["obs"]) == len(reference["obs"])
+    for obs, ref_obs in zip(vectorized["obs"], reference["obs"]):
+        assert obs.dtype == ref_obs.dtype
+        np.testing.assert_array_equal(obs, ref_obs)
+    assert vectorized["state"].dtype == reference["state"].dtype
+    np.testing.assert_array_equal(vectorized["state"], reference["state"])
+    assert vectorized["avail_actions"] == reference["avail_actions"]
+    np.testing.assert_array_equal(
+        vectorized["visibility"], reference["visibility"]
+    )
+
+
+@pytest.mark.parametrize("flags", env_flags)
+@pytest.mark.parametrize("map_name", map_names)
+def test_vectorized_matches_reference(map_name, flags):
+    envs = [
+        StarCraft2Env(
+            map_name=map_name,
+            run_config=FakeRunConfig(seed=0),
+            vectorized=vectorized,
+            **flags
+        )
+        for vectorized in (True, False)
+    ]
+    rng = np.random.RandomState(0)
+    try:
+        for env in envs:
+            env.reset()
+        for _ in range(60):
+            vectorized, reference = [get_outputs(env) for env in envs]
+            assert_outputs_equal(vectorized, reference)
+            actions = [
+                rng.choice(np.nonzero(avail)[0])
+                for avail in reference["avail_actions"]
+            ]
+            # The heuristic AI overwrites the actions it is given
+            results = [env.step(list(actions)) for env in envs]
+            assert results[0] == results[1]
+            if results[0][1]:
+                for env in envs:
+                    env.reset()
+    finally:
+        for env in envs:
+            env.close()
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_obs_timestep_number_row_width(vectorized):
+    env = StarCraft2Env(
+        map_name="3m",
+        run_config=FakeRunConfig(seed=0),
+        vectorized=vectorized,
+        obs_timestep_number=True,
+    )
+    try:
+        obs, _ = env.reset()
+        env.step([1] * env.n_agents)
+        for agent_obs in env.get_obs():
+            assert agent_obs.dtype == np.float64
+            assert agent_obs.shape == (env.get_obs_size() + 1,)
+        out = np.zeros((env.n_agents, env.get_obs_size() + 1), np.float32)
+        env.get_obs(out=out)
+        np.testing.assert_array_equal(out, np.array(env.get_obs(), np.float32))
+    finally:
+        env.close()
@@ -0,0 +1,272 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from absl import logging
+
+from pysc2.lib import protocol
+
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+from smac.env.starcraft2.vec_env import (
+    _add_terminal_observations,
+    _get_env_args,
+)
+
+
+class StarCraft2ThreadedEnv(object):
+    """Steps several StarCraft2Env instances of this process on a thread
+    pool.
+
+    The environments spend most of a step waiting on their StarCraft II
+    process, which releases the GIL, so stepping them on threads overlaps
+    the waits without the cost of subprocesses. The observations, states,
+    available actions, rewards and termination flags of all environments
+    are gathered into arrays whose first dimension indexes the environment.
+    These arrays are overwritten by the next call to step or reset.
+
+    Environments whose episode terminates are reset automatically within
+    step. As for StarCraft2VecEnv, the observations, state and available
+    actions of the terminal step are returned in its info as terminal_obs,
+    terminal_state and terminal_avail_actions.
+
+    An environment whose StarCraft II process fails during a step is
+    reported as terminated with an "error" entry in its info, and is
+    restarted in the background without holding up the others. Until its
+    restart completes it is skipped by step, reporting no reward, not
+    terminated and a "restarting" entry in its info. The observations of
+    the episode started by the restart are published by the next step,
+    which skips the actions given for that environment, as they were
+    chosen before the restart, and reports a "reset" entry in its info.
+    Other exceptions, e.g. for invalid actions, are raised by step as by
+    StarCraft2Env.step.
+    """
+
+    def __init__(self, n_envs, n_threads=None, **env_args):
+        """Create a threaded multi-environment driver.
+
+        Parameters
+        ----------
+        n_envs : int
+            The number of environments.
+        n_threads : int, optional
+            The number of threads used to step the environments (default is
+            None, in which case one thread per environment is used).
+        **env_args
+            Arguments passed to every StarCraft2Env. If a seed is given,
+            the environment with index i uses seed + i. If a record_path is
+            given, the environment with index i records into a file whose
+            name has _i appended before the extension.
+        """
+        self.n_envs = n_envs
+        self.envs = [
+            StarCraft2Env(**_get_env_args(env_args, env_id))
+            for env_id in range(n_envs)
+        ]
+        self.n_agents = self.envs[0].n_agents
+        self.n_actions = self.envs[0].n_actions
+        self.episode_limit = self.envs[0].episode_limit
+
+        self._buffers = {
+            name: np.zeros((n_envs,) + shape, dtype=dtype)
+            for name, shape, dtype in self.envs[0]._get_buffer_specs()
+        }
+        self._executor = ThreadPoolExecutor(max_workers=n_threads or n_envs)
+        self._restarts = [None] * n_envs
+
+    def _write_observations(self, env_id, buffers=None):
+        """Writes the observations, state and available actions of an
+        environment into its rows of the buffers, or into the given arrays,
+        which are returned.
+        """
+        if buffers is None:
+            buffers = {
+                name: self._buffers[name][env_id]
+                for name in ("obs", "state", "avail_actions")
+            }
+        env = self.envs[env_id]
+        env.get_obs(out=buffers["obs"])
+        env.get_state(out=buffers["state"])
+        env.get_avail_actions(out=buffers["avail_actions"])
+        return buffers
+
+    def _reset_env(self, env_id):
+        self.envs[env_id].reset()
+        self._write_observations(env_id)
+
+    def _step_env(self, env_id, actions):
+        env = self.envs[env_id]
+        # Send the request without the full restart that step performs on
+        # protocol errors, so that a restart does not hold up the step of
+        # the other environments
+        req_actions = env._build_action_request(actions)
+        env._obs = env._send_step_request(req_actions)
+        reward, terminated, info = env._process_step()
+        buffers = self._write_observations(env_id)
+        if terminated:
+            _add_terminal_observations(info, buffers)
+            env.reset()
+            self._write_observations(env_id)
+        return reward, terminated, info
+
+    def _restart_env(self, env_id):
+        """Restarts an environment and returns the observations of its new
+        episode. These are staged rather than written into the buffers,
+        which the restart may not touch while it runs in the background.
+        """
+        self.envs[env_id].full_restart()
+        self.envs[env_id].reset()
+        staged = {
+            name: np.zeros_like(self._buffers[name][env_id])
+            for name in ("obs", "state", "avail_actions")
+        }
+        return self._write_observations(env_id, staged)
+
+    def _publish_restarts(self):
+        """Writes the observations staged by the completed restarts into
+        the buffers, retrying failed restarts. Returns a list indicating
+        which environments have been restarted.
+        """
+        restarted = [False] * self.n_envs
+        for env_id, future in enumerate(self._restarts):
+            if future is None or not future.done():
+                continue
+            self._restarts[env_id] = None
+            if future.exception() is not None:
+                self._schedule_restart(env_id, future.exception())
+                continue
+            for name, array in future.result().items():
+                self._buffers[name][env_id] = array
+            restarted[env_id] = True
+        return restarted
+
+    def _schedule_restart(self, env_id, error):
+        logging.warning(
+            "Environment {} failed, restarting it: {!r}".format(env_id, error)
+        )
+        self._restarts[env_id] = self._executor.submit(
+            self._restart_env, env_id
+        )
+
+    def _run(self, fn, args_per_env, skip):
+        """Runs fn for every environment that is not skipped, and returns
+        the results per environment. Results are None for skipped
+        environments and the raised exception for environments whose
+        StarCraft II process failed, which are then restarted. Any other
+        exception, e.g. for invalid actions, is raised once fn has returned
+        for all environments.
+        """
+        futures = [
+            None
+            if skip[env_id]
+            else self._executor.submit(fn, env_id, *args_per_env[env_id])
+            for env_id in range(self.n_envs)
+        ]
+        results = [None] * self.n_envs
+        caller_error = None
+        for env_id, future in enumerate(futures):
+            if future is None:
+                continue
+            error = future.exception()
+            if error is None:
+                results[env_id] = future.result()
+            elif isinstance(
+                error, (protocol.ProtocolError, protocol.ConnectionError)
+            ):
+                results[env_id] = error
+                self._schedule_restart(env_id, error)
+            elif caller_error is None:
+                caller_error = error
+        if caller_error is not None:
+            raise caller_error
+        return results
+
+    def _get_skipped(self, restarted):
+        """Returns a list indicating which environments are skipped, as they
+        are being restarted or have just been restarted.
+        """
+        return [
+            restarted[env_id] or self._restarts[env_id] is not None
+            for env_id in range(self.n_envs)
+        ]
+
+    @property
+    def restarting(self):
+        """A boolean array indicating which environments are being
+        restarted, until the observations of their new episode are
+        published by the next step or reset.
+        """
+        return np.array([future is not None for future in self._restarts])
+
+    def reset(self):
+        """Reset all environments. Returns the observations and states.
+        Environments that have just been restarted are already reset.
+        """
+        restarted = self._publish_restarts()
+        self._run(
+            self._reset_env, [()] * self.n_envs, self._get_skipped(restarted)
+        )
+        return self.get_obs(), self.get_state()
+
+    def step(self, actions):
+        """A single step of all environments, given the actions as an
+        array-like of shape (n_envs, n_agents). Returns the rewards and
+        termination flags as arrays of shape (n_envs,) and a list of the
+        info dictionaries.
+        """
+        self._buffers["actions"][...] = actions
+        restarted = self._publish_restarts()
+        results = self._run(
+            self._step_env,
+            [(self._buffers["actions"][i],) for i in range(self.n_envs)],
+            self._get_skipped(restarted),
+        )
+        infos = []
+        for env_id, result in enumerate(results):
+            if restarted[env_id]:
+                reward, terminated, info = 0, False, {"reset": True}
+            elif result is None:
+                reward, terminated, info = 0, False, {"restarting": True}
+            elif isinstance(result, Exception):
+                reward, terminated, info = 0, True, {"error": repr(result)}
+            else:
+                reward, terminated, info = result
+            self._buffers["reward"][env_id] = reward
+            self._buffers["terminated"][env_id] = terminated
+            infos.append(info)
+        return self._buffers["reward"], self._buffers["terminated"], infos
+
+    def get_obs(self):
+        """Returns the observations as an array of shape
+        (n_envs, n_agents, obs_size).
+        """
+        return self._buffers["obs"]
+
+    def get_state(self):
+        """Returns the global states as an array of shape
+        (n_envs, state_size).
+        """
+        return self._buffers["state"]
+
+    def get_avail_actions(self):
+        """Returns the available actions as a uint8 array of shape
+        (n_envs, n_agents, n_actions).
+        """
+        return self._buffers["avail_actions"]
+
+    def get_stats(self):
+        """Returns the statistics of every environment in a list."""
+        return [env.get_stats() for env in self.envs]
+
+    def get_env_info(self):
+        env_info = self.envs[0].get_env_info()
+        env_info["n_envs"] = self.n_envs
+        return env_info
+
+    def close(self):
+        """Close all environments and their StarCraft II processes."""
+        self._executor.shutdown(wait=True)
+        for env in self.envs:
+            env.close()
@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import functools
+import inspect
+import time
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class PhaseTimer(object):
+    """Measures the latency of the phases of an environment with a monotonic
+    clock, keeping the latencies of the most recent calls of every phase.
+
+    Instead of checking whether timing is enabled on every call, methods are
+    timed by replacing them with timed wrappers, see wrap_methods, so that
+    environments without a timer are not slowed down at all.
+    """
+
+    def __init__(self, window=1000, callback=None):
+        """Create a timer.
+
+        Parameters
+        ----------
+        window : int, optional
+            The number of most recent latencies of each phase from which
+            percentiles are computed (default is 1000).
+        callback : callable, optional
+            A function called as callback(phase, seconds) after every timed
+            call (default is None).
+        """
+        self.window = window
+        self.callback = callback
+        self._latencies = collections.OrderedDict()
+        self._counts = collections.Counter()
+
+    def record(self, phase, seconds):
+        """Record the latency of a call of phase."""
+        latencies = self._latencies.get(phase)
+        if latencies is None:
+            latencies = collections.deque(maxlen=self.window)
+            self._latencies[phase] = latencies
+        latencies.append(seconds)
+        self._counts[phase] += 1
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    def wrap(self, phase, func):
+        """Returns func timed as phase. Coroutine functions are timed until
+        their coroutine completes.
+        """
+        perf_counter = time.perf_counter
+        record = self.record
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def timed_coroutine(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(phase, perf_counter() - start)
+
+            return timed_coroutine
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(phase, perf_counter() - start)
+
+        return timed
+
+    def wrap_methods(self, obj, phases):
+        """Time methods of obj, given a mapping from method names to
+        phases, by replacing them with timed wrappers on the instance.
+        """
+        for name, phase in phases.items():
+            setattr(obj, name, self.wrap(phase, getattr(obj, name)))
+
+    def get_stats(self):
+        """Returns the number of calls and the latency percentiles, in
+        seconds, of every phase, e.g. {"step_calls": 10,
+        "step_time_p50": ...}.
+        """
+        stats = {}
+        for phase, latencies in self._latencies.items():
+            stats["{}_calls".format(phase)] = self._counts[phase]
+            values = np.percentile(list(latencies), PERCENTILES)
+            for q, value in zip(PERCENTILES, values):
+                stats["{}_time_p{}".format(phase, q)] = float(value)
+        return stats
+
+    def clear(self):
+        """Discard all recorded latencies."""
+        self._latencies.clear()
+        self._counts.clear()
@@ -0,0 +1,250 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing as mp
+import os
+import traceback
+
+import numpy as np
+
+from smac.env.starcraft2.starcraft2 import StarCraft2Env
+
+
+def _as_arrays(raw_buffers, specs, n_envs):
+    """Returns numpy views of shared buffers, with the env dimension first."""
+    return {
+        name: np.frombuffer(raw_buffers[name], dtype=dtype).reshape(
+            (n_envs,) + shape
+        )
+        for name, shape, dtype in specs
+    }
+
+
+def _get_env_args(env_args, env_id):
+    """Returns the arguments of the environment with index env_id, whose
+    seed is offset by env_id and whose recording, if any, is written to its
+    own file, e.g. run_0.gz for a record_path of run.gz.
+    """
+    env_args = dict(env_args)
+    if env_args.get("seed") is not None:
+        env_args["seed"] += env_id
+    if env_args.get("record_path") is not None:
+        root, ext = os.path.splitext(env_args["record_path"])
+        env_args["record_path"] = "{}_{}{}".format(root, env_id, ext)
+    return env_args
+
+
+def _add_terminal_observations(info, buffers):
+    """Adds copies of the observations, state and available actions of a
+    terminal step to its info, before the environment is reset.
+    """
+    info["terminal_obs"] = buffers["obs"].copy()
+    info["terminal_state"] = buffers["state"].copy()
+    info["terminal_avail_actions"] = buffers["avail_actions"].copy()
+
+
+def _worker(remote, parent_remote, env_args, raw_buffers, n_envs, env_id):
+    """Runs a StarCraft2Env in a subprocess, executing the commands received
+    through remote and writing observations into the shared buffers.
+    """
+    parent_remote.close()
+    env = StarCraft2Env(**env_args)
+    buffers = _as_arrays(raw_buffers, env._get_buffer_specs(), n_envs)
+    buffers = {name: array[env_id, ...] for name, array in buffers.items()}
+
+    def write_observations():
+        env.get_obs(out=buffers["obs"])
+        env.get_state(out=buffers["state"])
+        env.get_avail_actions(out=buffers["avail_actions"])
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+            try:
+                if cmd == "step":
+                    reward, terminated, info = env.step(buffers["actions"])
+                    buffers["reward"][...] = reward
+                    buffers["terminated"][...] = terminated
+                    write_observations()
+                    if terminated:
+                        _add_terminal_observations(info, buffers)
+                        env.reset()
+                        write_observations()
+                    remote.send(("ok", info))
+                elif cmd == "reset":
+                    env.reset()
+                    write_observations()
+                    remote.send(("ok", None))
+                elif cmd == "get_stats":
+                    remote.send(("ok", env.get_stats()))
+                elif cmd == "save_replay":
+                    env.save_replay()
+                    remote.send(("ok", None))
+                elif cmd == "close":
+                    break
+                else:
+                    raise ValueError("Unknown command {}".format(cmd))
+            except Exception:
+                remote.send(("error", traceback.format_exc()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        remote.close()
+
+
+class StarCraft2VecEnv(object):
+    """Runs several StarCraft2Env instances in subprocesses and steps them in
+    lockstep.
+
+    The observations, states, available actions, rewards and termination
+    flags of all environments are exchanged through shared memory arrays
+    whose first dimension indexes the environment, rather than pickled.
+    The arrays returned by the methods below are these shared arrays, which
+    are overwritten by the next call to step or reset.
+
+    Environments whose episode terminates are reset automatically within
+    step, so the observations returned after a terminal step belong to the
+    first step of the next episode. Those of the terminal step, e.g. to
+    bootstrap the value of an episode cut at episode_limit, are returned
+    in its info as terminal_obs, terminal_state and terminal_avail_actions.
+    """
+
+    def __init__(self, n_envs, start_method=None, **env_args):
+        """Create a vectorised StarCraft II environment.
+
+        Parameters
+        ----------
+        n_envs : int
+            The number of environments to run in parallel.
+        start_method : str, optional
+            The multiprocessing start method of the subprocesses (default is
+            None, in which case the platform default is used).
+        **env_args
+            Arguments passed to every StarCraft2Env. If a seed is given,
+            the environment with index i uses seed + i. If a record_path is
+            given, the environment with index i records into a file whose
+            name has _i appended before the extension. A process_pool cannot
+            be shared with the subprocesses and raises a ValueError.
+        """
+        if env_args.get("process_pool") is not None:
+            raise ValueError(
+                "A process pool cannot be used by the subprocesses of "
+                "StarCraft2VecEnv."
+            )
+        self.n_envs = n_envs
+        # Only provides the environment info, so it records nothing
+        info_args = dict(env_args, record_path=None)
+        self._env_info_env = StarCraft2Env(**info_args)
+        self.n_agents = self._env_info_env.n_agents
+        self.n_actions = self._env_info_env.n_actions
+        self.episode_limit = self._env_info_env.episode_limit
+
+        ctx = mp.get_context(start_method)
+        specs = self._env_info_env._get_buffer_specs()
+        raw_buffers = {
+            name: ctx.RawArray(
+                "b",
+                n_envs * int(np.prod(shape)) * np.dtype(dtype).itemsize,
+            )
+            for name, shape, dtype in specs
+        }
+        self._buffers = _as_arrays(raw_buffers, specs, n_envs)
+
+        self._remotes, self._work_remotes = zip(
+            *[ctx.Pipe() for _ in range(n_envs)]
+        )
+        self._processes = []
+        for env_id, (remote, work_remote) in enumerate(
+            zip(self._remotes, self._work_remotes)
+        ):
+            process = ctx.Process(
+                target=_worker,
+                args=(
+                    work_remote,
+                    remote,
+                    _get_env_args(env_args, env_id),
+                    raw_buffers,
+                    n_envs,
+                    env_id,
+                ),
+                daemon=True,
+            )
+            process.start()
+            work_remote.close()
+            self._processes.append(process)
+        self._closed = False
+
+    def _call(self, cmd, data=None):
+        """Sends a command to all workers and returns their results."""
+        for remote in self._remotes:
+            remote.send((cmd, data))
+        results = [remote.recv() for remote in self._remotes]
+        for env_id, (status, result) in enumerate(results):
+            if status == "error":
+                raise RuntimeError(
+                    "Environment {} failed:\n{}".format(env_id, result)
+                )
+        return [result for _, result in results]
+
+    def reset(self):
+        """Reset all environments. Returns the observations and states."""
+        self._call("reset")
+        return self.get_obs(), self.get_state()
+
+    def step(self, actions):
+        """A single step of all environments, given the actions as an
+        array-like of shape (n_envs, n_agents). Returns the rewards and
+        termination flags as arrays of shape (n_envs,) and a list of the
+        info dictionaries.
+        """
+        self._buffers["actions"][...] = actions
+        infos = self._call("step")
+        return self._buffers["reward"], self._buffers["terminated"], infos
+
+    def get_obs(self):
+        """Returns the observations as an array of shape
+        (n_envs, n_agents, obs_size).
+        """
+        return self._buffers["obs"]
+
+    def get_state(self):
+        """Returns the global states as an array of shape
+        (n_envs, state_size).
+        """
+        return self._buffers["state"]
+
+    def get_avail_actions(self):
+        """Returns the available actions as a uint8 array of shape
+        (n_envs, n_agents, n_actions).
+        """
+        return self._buffers["avail_actions"]
+
+    def get_stats(self):
+        """Returns the statistics of every environment in a list."""
+        return self._call("get_stats")
+
+    def save_replay(self):
+        """Save a replay of every environment."""
+        self._call("save_replay")
+
+    def get_env_info(self):
+        env_info = self._env_info_env.get_env_info()
+        env_info["n_envs"] = self.n_envs
+        return env_info
+
+    def close(self):
+        """Close all environments and their StarCraft II processes."""
+        if self._closed:
+            return
+        for remote in self._remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self._processes:
+            process.join()
+        for remote in self._remotes:
+            remote.close()
+        self._closed = True